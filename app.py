@@ -1,397 +1,572 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, make_response, Response, stream_with_context
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
 from io import BytesIO
-from docx import Document
-from docx.shared import RGBColor, Pt, Inches
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from reportlab.lib.pagesizes import A4, LETTER, LEGAL
-from reportlab.pdfgen import canvas
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Table, TableStyle, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.enums import TA_LEFT, TA_CENTER, TA_RIGHT, TA_JUSTIFY
+import hashlib
+import os
 import traceback
-from reportlab.lib.styles import ParagraphStyle
-from reportlab.platypus import Paragraph, Spacer, Table, TableStyle
-import json
+import zipfile
+
+from decoding import (MAX_DELTA_OPS, MAX_REQUEST_BYTES, RequestRejected, loads, read_json_body, validate_delta,
+                      validate_margins, validate_op, validate_variables)
+from document_model import compile_delta, iter_nodes
+from renderers import RENDERERS, DEFAULT_MARGINS, render_pdf_stream
+from render_cache import RenderCache, cache_key
+from batch import BATCH_MAX_JOBS, stream_batch
+from template_store import TemplateStore
+from document_store import DocumentStore
+from fragment_cache import fragment_cache
+from assets import asset_registry
+from jobs import JobStore, JobQueue, JobRejected
+from metrics import metrics, stage, start_request, finish_request, profiling_active
+from serving import readiness, warm_up
 
 app = Flask(__name__)
+app.config["MAX_CONTENT_LENGTH"] = MAX_REQUEST_BYTES
 CORS(app)
 
+render_cache = RenderCache.from_env()
+template_store = TemplateStore()
+document_store = DocumentStore()
+job_store = JobStore()
+job_queue = JobQueue(job_store)
 
-# ===== DOCX Helper Functions =====
-def apply_docx_attributes(run, attrs):
-    """Apply Quill attributes to a docx run."""
-    if not attrs:
-        return
-    if attrs.get("bold"):
-        run.bold = True
-    if attrs.get("italic"):
-        run.italic = True
-    if attrs.get("underline"):
-        run.underline = True
-    if attrs.get("strike"): 
-        run.font.strike = True
-    # 🎨 Handle color (supports both #RRGGBB and #AARRGGBB)
-    if attrs.get("color"):
-        try:
-            hex_color = attrs["color"].lstrip("#")
-
-            # If alpha channel is present (e.g., #FFE53935), strip it
-            if len(hex_color) == 8:
-                hex_color = hex_color[2:]  # remove first 2 (alpha)
-
-            if len(hex_color) == 6:
-                r = int(hex_color[0:2], 16)
-                g = int(hex_color[2:4], 16)
-                b = int(hex_color[4:6], 16)
-                run.font.color.rgb = RGBColor(r, g, b)
-            else:
-                print(f"⚠️ Unexpected color format: {attrs['color']}")
-
-        except Exception as e:
-            print("⚠️ Invalid color:", e)
-
-
-def set_paragraph_alignment_docx(para, attrs):
-    """Set paragraph alignment."""
-    if not attrs:
-        return
-    align = attrs.get("align")
-    if align == "center":
-        para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    elif align == "right":
-        para.alignment = WD_ALIGN_PARAGRAPH.RIGHT
-    elif align == "justify":
-        para.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
-    else:
-        para.alignment = WD_ALIGN_PARAGRAPH.LEFT
-
-
-def create_list_paragraph(doc, text, attrs, list_type="bullet"):
-    """Create a properly aligned list paragraph with smaller indent."""
-    para = doc.add_paragraph(text, style="List Bullet" if list_type == "bullet" else "List Number")
-    para_format = para.paragraph_format
-    para_format.left_indent = Inches(0.25)
-    para_format.space_after = Pt(0)
-    para_format.line_spacing = Pt(14)
-    set_paragraph_alignment_docx(para, attrs)
-    for run in para.runs:
-        apply_docx_attributes(run, attrs)
-    return para
+app.before_request(start_request)
+app.after_request(finish_request)
+
+
+def get_request_json():
+    """Decode the JSON request body, timed as the ``decode`` stage."""
+    with stage("decode"):
+        data = read_json_body(request)
+    if data is not None and not isinstance(data, dict):
+        raise RequestRejected("Request body must be a JSON object", 422)
+    return data
+
+
+def validated(delta):
+    """Validate a delta against the request limits, timed as the ``validate`` stage.
+
+    Returns the delta with table embeds decoded, ready to compile.
+    """
+    with stage("validate"):
+        return validate_delta(delta)
+
+
+def rejected(error):
+    return jsonify({"error": str(error)}), error.status
+
+
+def parse_render_request(data):
+    """Pull delta, page size and validated margins out of a conversion request body."""
+    data = data or {}
+    delta = data.get("delta")
+    page_size_name = str(data.get("page_size", "A4")).strip().lower()
+    margins = data.get("margins")
+    validate_margins(margins)
+    return delta, page_size_name, margins or DEFAULT_MARGINS
+
+
+def send_rendered(content, fmt, etag=None):
+    """Send rendered bytes back as a downloadable attachment."""
+    return send_file(
+        BytesIO(content),
+        as_attachment=True,
+        download_name=f"document.{fmt}",
+        mimetype=RENDERERS[fmt][1],
+        etag=etag or False
+    )
+
+
+def send_rendered_with_stats(content, fmt, etag, stats):
+    """``send_rendered`` plus headers reporting what the render did (absent on cache hits)."""
+    response = send_rendered(content, fmt, etag=etag)
+    if "styles" in stats:
+        response.headers["X-Distinct-Styles"] = str(stats["styles"])
+    if "fragments_reused" in stats:
+        response.headers["X-Fragments-Reused"] = str(stats["fragments_reused"])
+    if "fonts" in stats:
+        response.headers["X-Pdf-Fonts"] = str(stats["fonts"])
+    return response
+
+
+def not_modified(etag):
+    """Empty 304 telling the client its copy is still current."""
+    response = make_response("", 304)
+    response.set_etag(etag)
+    return response
+
+
+def render_cached(fmt, key, compile_model, page_size_name, margins, stats=None):
+    """Return rendered bytes for ``key``, rendering and caching on a miss.
+
+    ``compile_model`` is only called on a miss, so cache hits skip the parse
+    and leave ``stats`` untouched. Profiled requests always render.
+    """
+    content = None
+    if not profiling_active():
+        with stage("cache"):
+            content = render_cache.get(key)
+    if content is None:
+        content = RENDERERS[fmt][0](compile_model(), page_size_name, margins, stats=stats)
+        with stage("cache"):
+            render_cache.put(key, content)
+    return content
+
+
+def compile_timed(delta):
+    with stage("compile"):
+        return compile_delta(delta)
+
+
+def convert_single(fmt):
+    """Shared body of the single-format conversion routes."""
+    delta, page_size_name, margins = parse_render_request(get_request_json())
+
+    if not delta:
+        return jsonify({"error": "No delta provided"}), 400
+
+    # validate before hashing: the cache key serialises the delta recursively
+    decoded = validated(delta)
+    key = cache_key(fmt, delta, page_size_name, margins)
+    if request.if_none_match.contains(key):
+        return not_modified(key)
+
+    stats = {}
+    content = render_cached(fmt, key, lambda: compile_timed(decoded), page_size_name, margins, stats)
+    return send_rendered_with_stats(content, fmt, key, stats)
 
 
 # ===== MAIN DOCX CONVERSION =====
 @app.route("/convert/delta-to-docx", methods=["POST"])
 def delta_to_docx():
     try:
-        data = request.get_json()
-        delta = data.get("delta")
-        page_size_name = str(data.get("page_size", "A4")).strip().lower()
-        margins = data.get("margins", {"top": 20, "bottom": 20, "left": 20, "right": 20})
+        return convert_single("docx")
+    except RequestRejected as e:
+        return rejected(e)
+    except Exception as e:
+        print("❌ Error:", traceback.format_exc())
+        return jsonify({"error": str(e)}), 500
+
+
+# ===== PDF Conversion =====
+@app.route("/convert/delta-to-pdf", methods=["POST"])
+def delta_to_pdf():
+    try:
+        return convert_single("pdf")
+    except RequestRejected as e:
+        return rejected(e)
+    except Exception as e:
+        print("❌ Error:", traceback.format_exc())
+        return jsonify({"error": str(e)}), 500
+
+
+def iter_ndjson_ops(stream):
+    """Yield validated delta ops one line at a time from an NDJSON request body."""
+    index = 0
+    try:
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            if index >= MAX_DELTA_OPS:
+                raise RequestRejected(f"delta has more than {MAX_DELTA_OPS} ops", 413)
+            try:
+                op = loads(line)
+            except ValueError:
+                raise RequestRejected(f"line {index + 1} is not valid JSON", 400) from None
+            yield validate_op(op, index)
+            index += 1
+    except RequestEntityTooLarge:
+        raise RequestRejected(f"Request body exceeds {MAX_REQUEST_BYTES} bytes", 413) from None
+
+
+@app.route("/convert/delta-to-pdf/stream", methods=["POST"])
+def delta_to_pdf_stream():
+    """Render a PDF from an NDJSON body of delta ops, one op per line.
+
+    Ops are read, compiled and turned into flowables lazily as layout consumes
+    them, so the request body is never decoded whole. The PDF itself is
+    buffered: the first byte goes out once the whole document has been laid
+    out, and the rest follows with chunked transfer encoding. ``page_size``
+    and ``margins`` (a JSON object) come from the query string.
+    """
+    try:
+        page_size_name = request.args.get("page_size", "A4").strip().lower()
+        try:
+            margins = loads(request.args["margins"]) if "margins" in request.args else DEFAULT_MARGINS
+        except ValueError:
+            raise RequestRejected("margins must be a JSON object", 400) from None
+        validate_margins(margins)
+
+        chunks = render_pdf_stream(iter_nodes(iter_ndjson_ops(request.stream)), page_size_name, margins)
+        # lay out eagerly so errors still surface as a JSON 500
+        first = next(chunks, b"")
+
+        def generate():
+            yield first
+            yield from chunks
+
+        return Response(
+            generate(),
+            mimetype="application/pdf",
+            headers={"Content-Disposition": "attachment; filename=document.pdf"}
+        )
+
+    except RequestRejected as e:
+        return rejected(e)
+    except Exception as e:
+        print("❌ Error:", traceback.format_exc())
+        return jsonify({"error": str(e)}), 500
+
+
+# ===== Multi-format Conversion =====
+@app.route("/convert/delta", methods=["POST"])
+def delta_to_formats():
+    """Render one delta to several formats from a single parse.
+
+    A single requested format is sent as-is; several are bundled in a ZIP.
+    """
+    try:
+        data = get_request_json()
+        delta, page_size_name, margins = parse_render_request(data)
+        formats = (data or {}).get("formats") or ["docx", "pdf"]
 
         if not delta:
             return jsonify({"error": "No delta provided"}), 400
-
-        doc = Document()
-
-        # === PAGE SETUP ===
-        section = doc.sections[0]
-        if "letter" in page_size_name:
-            section.page_height = Inches(11)
-            section.page_width = Inches(8.5)
-        elif "legal" in page_size_name:
-            section.page_height = Inches(14)
-            section.page_width = Inches(8.5)
-        else:
-            section.page_height = Inches(11.69)
-            section.page_width = Inches(8.27)
-
-        mm_to_inch = lambda mm: mm / 25.4
-        section.top_margin = Inches(mm_to_inch(margins["top"]))
-        section.bottom_margin = Inches(mm_to_inch(margins["bottom"]))
-        section.left_margin = Inches(mm_to_inch(margins["left"]))
-        section.right_margin = Inches(mm_to_inch(margins["right"]))
-
-        # === PROCESS DELTA ===
-        current_para = None
-        list_mode = None
-
-        for op in delta:
-            insert_data = op.get("insert")
-            attrs = op.get("attributes", {})
-
-            # ---- Handle custom tables (Firebase) ----
-            if isinstance(insert_data, dict) and "custom" in insert_data:
-                try:
-                    custom_data = json.loads(insert_data["custom"])
-                    table_json_str = custom_data.get("table")
-                    if table_json_str:
-                        table_data = json.loads(table_json_str)
-                        rows = table_data.get("rows", [])
-                        columns = table_data.get("columns", [])
-                        if rows:
-                            table = doc.add_table(rows=len(rows), cols=len(columns))
-                            for r_idx, row in enumerate(rows):
-                                for c_idx, col_key in enumerate(columns):
-                                    cell_ops = row.get(col_key, [])
-                                    cell_para = table.cell(r_idx, c_idx).paragraphs[0]
-                                    for cell_op in cell_ops:
-                                        text = cell_op.get("insert", "")
-                                        run = cell_para.add_run(text)
-                                        apply_docx_attributes(run, cell_op.get("attributes", {}))
-                            current_para = None
-                            continue
-                except Exception as e:
-                    print("⚠️ Table parse error:", e)
-                    continue
-
-            # ---- Plain text or list ----
-            if isinstance(insert_data, str):
-                list_type = attrs.get("list")
-
-                # Start new paragraph if necessary
-                if current_para is None or (list_type and list_mode != list_type):
-                    style = "List Bullet" if list_type == "bullet" else "List Number" if list_type == "ordered" else None
-                    current_para = doc.add_paragraph(style=style)
-                    list_mode = list_type
-
-                    pf = current_para.paragraph_format
-                    pf.left_indent = Inches(0.25 if list_type else 0)
-                    pf.space_after = Pt(0)
-                    pf.line_spacing = Pt(12)
-
-                # Handle line breaks within insert
-                parts = insert_data.split("\n")
-                for i, part in enumerate(parts):
-                    if part:
-                        run = current_para.add_run(part)
-                        apply_docx_attributes(run, attrs)
-                    if i < len(parts) - 1:  # newline means paragraph end
-                        set_paragraph_alignment_docx(current_para, attrs)
-                        current_para = doc.add_paragraph(style=("List Bullet" if list_type == "bullet" else "List Number" if list_type == "ordered" else None))
-                        pf = current_para.paragraph_format
-                        pf.left_indent = Inches(0.25 if list_type else 0)
-                        pf.space_after = Pt(0)
-                        pf.line_spacing = Pt(12)
-
-                # Apply alignment at the end of this op
-                set_paragraph_alignment_docx(current_para, attrs)
-
-        # === SAVE DOCX ===
-        output = BytesIO()
-        doc.save(output)
-        output.seek(0)
+        if not isinstance(formats, list) or not all(isinstance(fmt, str) for fmt in formats):
+            return jsonify({"error": "formats must be a list of format names"}), 400
+        unknown = [fmt for fmt in formats if fmt not in RENDERERS]
+        if unknown:
+            return jsonify({"error": f"Unsupported formats: {unknown}"}), 400
+        formats = list(dict.fromkeys(formats))
+
+        decoded = validated(delta)
+        keys = {fmt: cache_key(fmt, delta, page_size_name, margins) for fmt in formats}
+        etag = keys[formats[0]] if len(formats) == 1 else hashlib.sha256(
+            "".join(keys.values()).encode("ascii")).hexdigest()
+        if request.if_none_match.contains(etag):
+            return not_modified(etag)
+
+        # compile at most once, and only if some format misses the cache
+        model = []
+        def compile_model():
+            if not model:
+                model.append(compile_timed(decoded))
+            return model[0]
+
+        rendered = {
+            fmt: render_cached(fmt, keys[fmt], compile_model, page_size_name, margins)
+            for fmt in formats
+        }
+
+        if len(rendered) == 1:
+            fmt, content = next(iter(rendered.items()))
+            return send_rendered(content, fmt, etag=etag)
+
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zf:
+            for fmt, content in rendered.items():
+                zf.writestr(f"document.{fmt}", content)
+        archive.seek(0)
         return send_file(
-            output,
+            archive,
             as_attachment=True,
-            download_name="document.docx",
-            mimetype="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+            download_name="documents.zip",
+            mimetype="application/zip",
+            etag=etag
         )
 
+    except RequestRejected as e:
+        return rejected(e)
     except Exception as e:
         print("❌ Error:", traceback.format_exc())
         return jsonify({"error": str(e)}), 500
 
 
+# ===== Batch Conversion =====
+@app.route("/convert/batch", methods=["POST"])
+def convert_batch():
+    """Render a list of jobs in parallel and stream the results as a ZIP."""
+    try:
+        data = get_request_json() or {}
+        jobs = data.get("jobs")
+
+        if not jobs or not isinstance(jobs, list):
+            return jsonify({"error": "No jobs provided"}), 400
+        if len(jobs) > BATCH_MAX_JOBS:
+            return jsonify({"error": f"Too many jobs (max {BATCH_MAX_JOBS})"}), 413
+
+        return Response(
+            stream_with_context(stream_batch(jobs, render_cache)),
+            mimetype="application/zip",
+            headers={"Content-Disposition": "attachment; filename=batch.zip"}
+        )
+
+    except RequestRejected as e:
+        return rejected(e)
+    except Exception as e:
+        print("❌ Error:", traceback.format_exc())
+        return jsonify({"error": str(e)}), 500
 
-# ===== PDF Helper Functions =====
-def get_pdf_alignment(align):
-    if align == "center":
-        return TA_CENTER
-    elif align == "right":
-        return TA_RIGHT
-    elif align == "justify":
-        return TA_JUSTIFY
-    return TA_LEFT
 
-def parse_color(color_code):
-    """Convert hex color to ReportLab color."""
+# ===== Templates =====
+@app.route("/templates", methods=["POST"])
+def register_template():
+    """Precompile a template delta and return its id and placeholder names."""
     try:
-        if not color_code.startswith("#"):
-            color_code = f"#{color_code}"
-        return colors.HexColor(color_code)
-    except:
-        return colors.black
-
-def apply_text_styles(text, attrs):
-    """Apply all inline styles: bold, italic, underline, strike, color, background."""
-    if not text:
-        return ""
-    if not attrs:
-        return text.replace("\n", "<br/>")
-    
-    styled_text = text
-    if attrs.get("bold"):
-        styled_text = f"<b>{styled_text}</b>"
-    if attrs.get("italic"):
-        styled_text = f"<i>{styled_text}</i>"
-    if attrs.get("underline"):
-        styled_text = f"<u>{styled_text}</u>"
-    if attrs.get("strike"):
-        styled_text = f"<strike>{styled_text}</strike>"
-    if attrs.get("color"):
-        styled_text = f'<font color="{attrs["color"]}">{styled_text}</font>'
-    if attrs.get("background"):
-        styled_text = f'<font backColor="{attrs["background"]}">{styled_text}</font>'
-    return styled_text.replace("\n", "<br/>")
+        delta, page_size_name, margins = parse_render_request(get_request_json())
+
+        if not delta:
+            return jsonify({"error": "No delta provided"}), 400
+        validated(delta)
 
+        compiled = template_store.register(delta, page_size_name, margins)
+        return jsonify({"id": compiled.template_id, "placeholders": compiled.placeholders}), 201
 
-# ===== PDF Conversion =====
-@app.route("/convert/delta-to-pdf", methods=["POST"])
-def delta_to_pdf():
+    except RequestRejected as e:
+        return rejected(e)
+    except Exception as e:
+        print("❌ Error:", traceback.format_exc())
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/templates/<template_id>/render", methods=["POST"])
+def render_template_variables(template_id):
+    """Fill a registered template's placeholders and return the document."""
     try:
-        import json
-        data = request.get_json()
-        delta = data.get("delta")
-        page_size_name = str(data.get("page_size", "A4")).strip().lower()
-        margins = data.get("margins", {"top": 20, "bottom": 20, "left": 20, "right": 20})
+        data = get_request_json() or {}
+        variables = data.get("variables") or {}
+        fmt = str(data.get("format", "pdf")).lower()
+
+        if fmt not in RENDERERS:
+            return jsonify({"error": f"Unsupported format: {fmt}"}), 400
+        if not isinstance(variables, dict):
+            return jsonify({"error": "variables must be an object"}), 400
+        validate_variables(variables)
+
+        compiled = template_store.get(template_id)
+        if compiled is None:
+            return jsonify({"error": "Template not found"}), 404
+
+        key = cache_key(fmt, {"template": template_id, "variables": variables}, compiled.page_size_name, compiled.margins)
+        if request.if_none_match.contains(key):
+            return not_modified(key)
+
+        with stage("cache"):
+            content = render_cache.get(key)
+        if content is None:
+            with stage("template_fill"):
+                content = compiled.render(fmt, variables)
+            with stage("cache"):
+                render_cache.put(key, content)
+        return send_rendered(content, fmt, etag=key)
+
+    except RequestRejected as e:
+        return rejected(e)
+    except Exception as e:
+        print("❌ Error:", traceback.format_exc())
+        return jsonify({"error": str(e)}), 500
+
+
+# ===== Documents and change-deltas =====
+@app.route("/documents", methods=["POST"])
+def register_document():
+    """Store a base document that change-deltas can be posted against."""
+    try:
+        delta = (get_request_json() or {}).get("delta")
 
         if not delta:
             return jsonify({"error": "No delta provided"}), 400
+        validated(delta)
 
-        PAGE_SIZES = {"a4": A4, "letter": LETTER, "legal": LEGAL}
-        page_size = PAGE_SIZES.get(page_size_name, A4)
-
-        buffer = BytesIO()
-        doc = SimpleDocTemplate(
-            buffer,
-            pagesize=page_size,
-            topMargin=margins["top"],
-            bottomMargin=margins["bottom"],
-            leftMargin=margins["left"],
-            rightMargin=margins["right"]
-        )
+        document_id = document_store.put(delta)
 
-        story = []
-        styles = getSampleStyleSheet()
-
-        paragraph_ops = []
-        list_blocks = []
-        current_alignment = None
-
-        def flush_paragraph():
-            """Render one full paragraph or list item."""
-            nonlocal paragraph_ops, current_alignment
-            if not paragraph_ops:
-                return
-
-            # Merge all styled fragments
-            html_text = "".join([
-                apply_text_styles(op["insert"], op.get("attributes", {}))
-                for op in paragraph_ops
-                if isinstance(op.get("insert"), str)
-            ]).strip()
-
-            if not html_text:
-                paragraph_ops = []
-                current_alignment = None
-                return
-
-            paragraph_style = ParagraphStyle(
-                name="Custom",
-                parent=styles["Normal"],
-                alignment=get_pdf_alignment(current_alignment),
-                leading=14,
-                spaceAfter=6,
-            )
-
-            if current_list_type == "bullet":
-                story.append(Paragraph(html_text, paragraph_style, bulletText="•"))
-            elif current_list_type == "ordered":
-                story.append(Paragraph(f"{list_counters['ordered']}. {html_text}", paragraph_style))
-                list_counters["ordered"] += 1
-            else:
-                story.append(Paragraph(html_text, paragraph_style))
-
-            story.append(Spacer(1, 4))
-            paragraph_ops = []
-            current_alignment = None
-
-        current_list_type = None
-        list_counters = {"ordered": 1}
-
-        for op in delta:
-            insert_data = op.get("insert")
-            attrs = op.get("attributes", {})
-
-            # Handle table
-            if isinstance(insert_data, dict) and "custom" in insert_data:
-                try:
-                    custom_data = json.loads(insert_data["custom"])
-                    table_json_str = custom_data.get("table")
-                    if table_json_str:
-                        table_data_parsed = json.loads(table_json_str)
-                        rows = table_data_parsed.get("rows", [])
-                        col_keys = table_data_parsed.get("columns", [])
-                        col_count = len(col_keys)
-                        data_rows = []
-
-                        for row in rows:
-                            row_cells = []
-                            for col_key in col_keys:
-                                cell_ops = row.get(col_key, [])
-                                cell_text = ""
-                                for cell_op in cell_ops:
-                                    cell_text += apply_text_styles(cell_op.get("insert", ""), cell_op.get("attributes", {}))
-                                row_cells.append(Paragraph(cell_text or "&nbsp;", styles["Normal"]))
-                            data_rows.append(row_cells)
-
-                        table = Table(
-                            data_rows,
-                            colWidths=[(page_size[0] - margins["left"] - margins["right"]) / col_count] * col_count,
-                            style=TableStyle([
-                                ("GRID", (0, 0), (-1, -1), 0.5, colors.black),
-                                ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
-                            ])
-                        )
-                        story.append(table)
-                        story.append(Spacer(1, 12))
-                        continue
-                except Exception as e:
-                    print("⚠️ Table parse error:", e)
-                    continue
-
-            # Handle text
-            if isinstance(insert_data, str):
-                parts = insert_data.split("\n")
-                for i, part in enumerate(parts):
-                    if part:
-                        paragraph_ops.append({"insert": part, "attributes": attrs})
-
-                    # If newline marks the end of a paragraph or list
-                    if i < len(parts) - 1:
-                        # Capture alignment and list from newline attributes
-                        current_alignment = attrs.get("align", current_alignment)
-                        list_attr = attrs.get("list")
-
-                        if list_attr:
-                            current_list_type = list_attr
-                        else:
-                            current_list_type = None
-
-                        flush_paragraph()
-
-
-        flush_paragraph()
-
-        doc.build(story)
-        buffer.seek(0)
-        return send_file(
-            buffer,
-            as_attachment=True,
-            download_name="document.pdf",
-            mimetype="application/pdf"
-        )
+        response = jsonify({"id": document_id})
+        response.status_code = 201
+        response.headers["Location"] = f"/documents/{document_id}"
+        return response
 
+    except RequestRejected as e:
+        return rejected(e)
     except Exception as e:
         print("❌ Error:", traceback.format_exc())
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/documents/<document_id>")
+def get_document(document_id):
+    delta = document_store.get(document_id)
+    if delta is None:
+        return jsonify({"error": "Document not found"}), 404
+    return jsonify({"id": document_id, "delta": delta})
+
+
+@app.route("/documents/<document_id>/changes", methods=["POST"])
+def apply_document_change(document_id):
+    """Apply a Quill change-delta to a stored document and render the result.
+
+    The result is stored as a new document; its id comes back in the
+    ``X-Document-Id`` header for the next change.
+    """
+    try:
+        data = get_request_json() or {}
+        _, page_size_name, margins = parse_render_request(data)
+        change = data.get("change")
+        if isinstance(change, dict):
+            change = change.get("ops")
+        fmt = str(data.get("format", "pdf")).lower()
+
+        if fmt not in RENDERERS:
+            return jsonify({"error": f"Unsupported format: {fmt}"}), 400
+        if isinstance(change, list) and len(change) > MAX_DELTA_OPS:
+            return jsonify({"error": f"change has {len(change)} ops, the limit is {MAX_DELTA_OPS}"}), 413
+
+        try:
+            with stage("compose"):
+                applied = document_store.apply(document_id, change)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 422
+        if applied is None:
+            return jsonify({"error": "Document not found"}), 404
+        # only a document that could have been posted whole is stored
+        decoded = validated(applied)
+        new_id = document_store.put(applied)
+
+        key = cache_key(fmt, {"document": new_id}, page_size_name, margins)
+        stats = {}
+        content = render_cached(fmt, key, lambda: compile_timed(decoded), page_size_name, margins, stats)
+        response = send_rendered_with_stats(content, fmt, key, stats)
+        response.headers["X-Document-Id"] = new_id
+        response.headers["Location"] = f"/documents/{new_id}"
+        return response
+
+    except RequestRejected as e:
+        return rejected(e)
+    except Exception as e:
+        print("❌ Error:", traceback.format_exc())
+        return jsonify({"error": str(e)}), 500
+
+
+# ===== Async Jobs =====
+def job_status(job):
+    """Public view of a job row."""
+    status = {
+        "id": job["id"],
+        "status": job["status"],
+        "format": job["format"],
+        "progress": {
+            "ops_total": job["ops_total"],
+            "ops_processed": job["ops_processed"],
+            "pages": job["pages"],
+        },
+        "created_at": job["created_at"],
+        "finished_at": job["finished_at"],
+        "expires_at": job["expires_at"],
+    }
+    if job["error"]:
+        status["error"] = job["error"]
+    if job["status"] == "done":
+        status["result_url"] = f"/jobs/{job['id']}/result"
+    return status
+
+
+@app.route("/jobs", methods=["POST"])
+def create_job():
+    """Queue a render in the background and return its id straight away."""
+    try:
+        data = get_request_json()
+        delta, page_size_name, margins = parse_render_request(data)
+        fmt = str((data or {}).get("format", "pdf")).lower()
+
+        if not delta:
+            return jsonify({"error": "No delta provided"}), 400
+        if fmt not in RENDERERS:
+            return jsonify({"error": f"Unsupported format: {fmt}"}), 400
+        validated(delta)
+
+        client = request.headers.get("X-Client-Id") or request.remote_addr or "anonymous"
+        try:
+            job_id = job_queue.submit(client, fmt, delta, page_size_name, margins)
+        except JobRejected as e:
+            return jsonify({"error": str(e)}), e.status
+
+        response = jsonify(job_status(job_store.get(job_id)))
+        response.status_code = 202
+        response.headers["Location"] = f"/jobs/{job_id}"
+        return response
+
+    except RequestRejected as e:
+        return rejected(e)
+    except Exception as e:
+        print("❌ Error:", traceback.format_exc())
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/jobs/<job_id>")
+def get_job(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job_status(job))
+
+
+@app.route("/jobs/<job_id>/result")
+def get_job_result(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    if job["status"] != "done":
+        return jsonify({"error": f"Job is {job['status']}"}), 409
+    return send_file(
+        job["artifact"],
+        as_attachment=True,
+        download_name=f"document.{job['format']}",
+        mimetype=RENDERERS[job["format"]][1]
+    )
+
+
+@app.route("/metrics")
+def prometheus_metrics():
+    cache = render_cache.stats()
+    fragments = fragment_cache.stats()
+    gauges = {
+        "legallyai_render_cache_hits": ("Render cache memory hits.", cache["hits"]),
+        "legallyai_render_cache_disk_hits": ("Render cache disk hits.", cache["disk_hits"]),
+        "legallyai_render_cache_misses": ("Render cache misses.", cache["misses"]),
+        "legallyai_render_cache_bytes": ("Bytes held in the in-memory render cache.", cache["bytes"]),
+        "legallyai_fragment_cache_hits": ("Blocks rendered from the fragment cache.", fragments["hits"]),
+        "legallyai_fragment_cache_misses": ("Blocks rendered from scratch.", fragments["misses"]),
+        "legallyai_fragment_cache_bytes": ("Estimated bytes held by cached fragments.", fragments["bytes"]),
+    }
+    return Response(metrics.render_prometheus(gauges), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/cache/stats")
+def cache_stats():
+    return jsonify({**render_cache.stats(), "fragments": fragment_cache.stats()})
+
+
+@app.route("/assets")
+def asset_stats():
+    return jsonify(asset_registry.stats())
+
+
+@app.route("/ready")
+def ready():
+    # Servers started without wsgi.py (e.g. ``flask run``) warm up on the first probe
+    if readiness()["status"] == "cold":
+        warm_up()
+    state = readiness()
+    return jsonify(state), 200 if state["status"] == "ready" else 503
+
+
 @app.route("/routes")
 def list_routes():
     return jsonify([str(rule) for rule in app.url_map.iter_rules()])
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    # Development server only; production runs under gunicorn (see gunicorn.conf.py)
+    warm_up()
+    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)),
+            debug=os.environ.get("FLASK_DEBUG", "0") in ("1", "true", "yes"))
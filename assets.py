@@ -0,0 +1,307 @@
+"""Process-wide registry of the fonts and images embedded in PDF output.
+
+TrueType fonts in ``PDF_FONT_DIR`` and images in ``PDF_IMAGE_DIR`` are loaded
+once per process; with a preloaded gunicorn app that is once in the master,
+and workers inherit them. Font files are memory-mapped instead of read into
+memory, so every worker shares the same page-cache pages. Each font's glyph
+metrics are parsed once and reused for every measurement. ReportLab embeds
+only the glyphs a document uses. The subset tables it cuts from a font are
+cached too, because revisions of a document keep asking for the same ones.
+Images are encoded into a PDF image object once, and each document references
+a copy of it.
+
+Font files are named ``<Family>-Regular.ttf``, ``-Bold``, ``-Italic`` and
+``-BoldItalic``; a file without one of these suffixes is a regular face.
+``PDF_FONT`` picks the family used for body text and table cells, and
+``PDF_LETTERHEAD`` names the image drawn in the top margin of every page.
+"""
+import copy
+import hashlib
+import mmap
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from PIL import Image
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfdoc, pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+
+PDF_FONT_DIR = os.environ.get("PDF_FONT_DIR", "")
+PDF_IMAGE_DIR = os.environ.get("PDF_IMAGE_DIR", "")
+PDF_FONT = os.environ.get("PDF_FONT", "Helvetica")
+PDF_LETTERHEAD = os.environ.get("PDF_LETTERHEAD", "")
+PDF_PAGE_COMPRESSION = os.environ.get("PDF_PAGE_COMPRESSION", "1") not in ("0", "false", "no")
+FONT_SUBSET_CACHE_SIZE = int(os.environ.get("FONT_SUBSET_CACHE_SIZE", 256))
+
+DEFAULT_FONT = "Helvetica"
+FONT_EXTENSIONS = (".ttf",)
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".bmp")
+# file name suffix -> (bold, italic)
+FACE_SUFFIXES = {
+    "-Regular": (False, False),
+    "-Bold": (True, False),
+    "-Italic": (False, True),
+    "-BoldItalic": (True, True),
+}
+
+
+def split_face_name(stem):
+    """Return ``(family, bold, italic)`` for a font file name without extension."""
+    for suffix, (bold, italic) in FACE_SUFFIXES.items():
+        if stem.endswith(suffix) and len(stem) > len(suffix):
+            return stem[:-len(suffix)], bold, italic
+    return stem, False, False
+
+
+class _MappedFile:
+    """File-like object whose ``read`` returns a read-only map of the whole file."""
+
+    def __init__(self, path):
+        self.name = path
+        with open(path, "rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read(self):
+        return self._data
+
+
+class MappedTTFont(TTFont):
+    """A ``TTFont`` parsed from a memory-mapped file whose subsets are cached.
+
+    The face keeps a read position while it cuts a subset, so building subsets
+    is serialised per font; documents rendered on other threads wait for it.
+    """
+
+    def __init__(self, name, path, subset_cache_size=FONT_SUBSET_CACHE_SIZE):
+        super().__init__(name, _MappedFile(path))
+        self.path = path
+        self.subset_cache_size = subset_cache_size
+        self.subset_hits = 0
+        self.subset_misses = 0
+        self._subsets = OrderedDict()
+        self._subset_lock = threading.Lock()
+        self._make_subset = self.face.makeSubset
+        self.face.makeSubset = self.make_subset
+
+    def make_subset(self, subset):
+        """Return the embedded font program for ``subset`` (a list of code points)."""
+        key = tuple(subset)
+        with self._subset_lock:
+            data = self._subsets.get(key)
+            if data is not None:
+                self._subsets.move_to_end(key)
+                self.subset_hits += 1
+                return data
+            self.subset_misses += 1
+            data = self._make_subset(subset)
+            if self.subset_cache_size > 0:
+                self._subsets[key] = data
+                while len(self._subsets) > self.subset_cache_size:
+                    self._subsets.popitem(last=False)
+            return data
+
+
+class ImageAsset:
+    """An image encoded once as a PDF image object."""
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        with open(path, "rb") as f:
+            self.digest = hashlib.sha1(f.read()).hexdigest()
+        with Image.open(path) as image:
+            self.width, self.height = image.size
+            if image.format == "JPEG":
+                # JPEG data is embedded as is
+                self.xobject = pdfdoc.PDFImageXObject(self.digest, path)
+            else:
+                # flatten transparency onto the white page once, here
+                rgba = image.convert("RGBA")
+                flat = Image.new("RGB", image.size, "white")
+                flat.paste(rgba, mask=rgba.getchannel("A"))
+                self.xobject = pdfdoc.PDFImageXObject(self.digest, ImageReader(flat))
+
+    def draw(self, canvas, x, y, width, height):
+        """Draw the image as large as fits the box, centred at its top edge.
+
+        This is ``Canvas.drawImage`` minus the decoding and encoding, which
+        was done once when the image was registered.
+        """
+        doc = canvas._doc
+        name = doc.getXObjectName(self.digest)
+        if name not in doc.idToObject:
+            xobject = copy.copy(self.xobject)
+            canvas._setXObjects(xobject)
+            doc.Reference(xobject, name)
+            doc.addForm(self.digest, xobject)
+        scale = min(width / self.width, height / self.height)
+        drawn_width = self.width * scale
+        drawn_height = self.height * scale
+        canvas.saveState()
+        canvas.translate(x + (width - drawn_width) / 2, y + height - drawn_height)
+        canvas.scale(drawn_width, drawn_height)
+        canvas._code.append(f"/{name} Do")
+        canvas.restoreState()
+        canvas._formsinuse.append(self.digest)
+        canvas._currentPageHasImages = 1
+
+
+def _scan(directory, extensions):
+    if not directory or not os.path.isdir(directory):
+        return []
+    return sorted(
+        entry.path for entry in os.scandir(directory)
+        if entry.is_file() and os.path.splitext(entry.name)[1].lower() in extensions
+    )
+
+
+class AssetRegistry:
+    """Fonts and images registered with ReportLab once per process."""
+
+    def __init__(self, font_dir="", image_dir="", body_font=DEFAULT_FONT, letterhead="",
+                 page_compression=True, subset_cache_size=FONT_SUBSET_CACHE_SIZE):
+        self.font_dir = font_dir
+        self.image_dir = image_dir
+        self.requested_font = body_font or DEFAULT_FONT
+        self.letterhead_name = letterhead
+        self.page_compression = page_compression
+        self.subset_cache_size = subset_cache_size
+        self.fonts = {}
+        self.families = {}
+        self.images = {}
+        self._body_font = DEFAULT_FONT
+        self._letterhead = None
+        self._fingerprint = None
+        self._loaded = False
+        self.load_seconds = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            font_dir=PDF_FONT_DIR,
+            image_dir=PDF_IMAGE_DIR,
+            body_font=PDF_FONT,
+            letterhead=PDF_LETTERHEAD,
+            page_compression=PDF_PAGE_COMPRESSION,
+            subset_cache_size=FONT_SUBSET_CACHE_SIZE,
+        )
+
+    def load(self):
+        """Register the configured fonts and images; safe to call repeatedly.
+
+        A file that cannot be loaded is skipped with a warning, and an unknown
+        body font or letterhead falls back to Helvetica or no letterhead.
+        """
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            start = time.perf_counter()
+            self._load_fonts()
+            self._load_images()
+            self._fingerprint = self._compute_fingerprint()
+            self.load_seconds = round(time.perf_counter() - start, 4)
+            self._loaded = True
+
+    def _load_fonts(self):
+        faces = {}
+        for path in _scan(self.font_dir, FONT_EXTENSIONS):
+            stem = os.path.splitext(os.path.basename(path))[0]
+            family, bold, italic = split_face_name(stem)
+            # the regular face is registered under the family name itself
+            name = family if not (bold or italic) else stem
+            try:
+                font = MappedTTFont(name, path, self.subset_cache_size)
+            except Exception as e:
+                print(f"⚠️ Skipping font {path}: {e}")
+                continue
+            pdfmetrics.registerFont(font)
+            self.fonts[name] = font
+            faces.setdefault(family, {})[(bold, italic)] = name
+
+        for family, styles in faces.items():
+            normal = styles.get((False, False)) or next(iter(styles.values()))
+            bold = styles.get((True, False), normal)
+            italic = styles.get((False, True), normal)
+            bold_italic = styles.get((True, True), bold if bold != normal else italic)
+            pdfmetrics.registerFontFamily(normal, normal=normal, bold=bold, italic=italic, boldItalic=bold_italic)
+            self.families[family] = {"normal": normal, "bold": bold, "italic": italic, "boldItalic": bold_italic}
+
+        requested = self.requested_font
+        if requested in self.families:
+            self._body_font = self.families[requested]["normal"]
+        elif requested in self.fonts or requested in pdfmetrics.standardFonts:
+            self._body_font = requested
+        else:
+            print(f"⚠️ Unknown PDF font {requested!r}, using {DEFAULT_FONT}")
+            self._body_font = DEFAULT_FONT
+
+    def _load_images(self):
+        for path in _scan(self.image_dir, IMAGE_EXTENSIONS):
+            name = os.path.splitext(os.path.basename(path))[0]
+            try:
+                self.images[name] = ImageAsset(name, path)
+            except Exception as e:
+                print(f"⚠️ Skipping image {path}: {e}")
+        if self.letterhead_name:
+            self._letterhead = self.images.get(self.letterhead_name)
+            if self._letterhead is None:
+                print(f"⚠️ Unknown letterhead image {self.letterhead_name!r}")
+
+    def _compute_fingerprint(self):
+        parts = [self._body_font, self._letterhead.digest if self._letterhead else "", str(self.page_compression)]
+        for name, font in sorted(self.fonts.items()):
+            info = os.stat(font.path)
+            parts.append(f"{name}:{info.st_size}:{info.st_mtime_ns}")
+        return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+    @property
+    def body_font(self):
+        """Font name for body text and table cells."""
+        self.load()
+        return self._body_font
+
+    @property
+    def letterhead(self):
+        """The ``ImageAsset`` drawn at the top of every page, or None."""
+        self.load()
+        return self._letterhead
+
+    @property
+    def fingerprint(self):
+        """Digest of everything here that changes PDF output."""
+        self.load()
+        return self._fingerprint
+
+    def stats(self):
+        self.load()
+        return {
+            "body_font": self._body_font,
+            "letterhead": self._letterhead.name if self._letterhead else None,
+            "page_compression": self.page_compression,
+            "load_seconds": self.load_seconds,
+            "fingerprint": self._fingerprint,
+            "families": self.families,
+            "fonts": {
+                name: {
+                    "path": font.path,
+                    "bytes": len(font.face._ttf_data),
+                    "glyphs": len(font.face.charToGlyph),
+                    "subsets_cached": len(font._subsets),
+                    "subset_hits": font.subset_hits,
+                    "subset_misses": font.subset_misses,
+                }
+                for name, font in sorted(self.fonts.items())
+            },
+            "images": {
+                name: {"path": image.path, "width": image.width, "height": image.height}
+                for name, image in sorted(self.images.items())
+            },
+        }
+
+
+asset_registry = AssetRegistry.from_env()
@@ -0,0 +1,192 @@
+"""Batch conversion: render many jobs in a process pool and stream a ZIP back.
+
+Each finished job is written to the archive as soon as its worker returns, so
+the response starts flowing before the slowest document is done and the full
+archive is never held in memory. A failing job produces an ``errors/`` entry
+and a ``failed`` line in ``manifest.json`` instead of aborting the batch.
+"""
+import io
+import json
+import multiprocessing
+import os
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from decoding import RequestRejected, validate_delta, validate_margins
+from document_model import compile_delta
+from renderers import RENDERERS, DEFAULT_MARGINS
+from render_cache import cache_key
+
+BATCH_MAX_JOBS = int(os.environ.get("BATCH_MAX_JOBS", 500))
+# The pool is per server worker, so by default the host's cores are shared out
+# between WEB_CONCURRENCY pools rather than each one starting a process per core.
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", 0)) or max(
+    1, (os.cpu_count() or 1) // max(1, int(os.environ.get("WEB_CONCURRENCY", 1)))
+)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Create the worker pool on first use, after the server has forked.
+
+    Pool processes come from a fork server rather than a fork of this
+    process: a request thread may hold a lock (fragment cache, style registry,
+    font subsets) at the moment of the fork, and the child would wait on that
+    lock forever.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload(["batch"])
+            _pool = ProcessPoolExecutor(max_workers=BATCH_WORKERS, mp_context=context)
+        return _pool
+
+
+def _discard_pool(broken):
+    """Drop a pool whose processes died so the next ``get_pool`` starts a new one."""
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def submit_job(fmt, delta, page_size_name, margins):
+    """Queue one render, replacing the pool once if it is broken.
+
+    A pool breaks for good when one of its processes is killed (by the OOM
+    killer, say); without this every later batch in the worker would fail.
+    """
+    pool = get_pool()
+    try:
+        return pool.submit(render_job, fmt, delta, page_size_name, margins)
+    except BrokenProcessPool:
+        print("⚠️ Batch pool is broken, starting a new one")
+        _discard_pool(pool)
+        return get_pool().submit(render_job, fmt, delta, page_size_name, margins)
+
+
+def render_job(fmt, delta, page_size_name, margins):
+    """Render one job; runs inside a pool worker."""
+    return RENDERERS[fmt][0](compile_delta(delta), page_size_name, margins)
+
+
+def normalize_job(index, job):
+    """Validate one job spec and return ``(name, fmt, delta, page_size, margins)``."""
+    if not isinstance(job, dict):
+        raise ValueError("Job must be an object")
+    fmt = str(job.get("format", "pdf")).lower()
+    if fmt not in RENDERERS:
+        raise ValueError(f"Unsupported format: {fmt}")
+    delta = job.get("delta")
+    if not delta:
+        raise ValueError("No delta provided")
+    margins = job.get("margins")
+    try:
+        validate_delta(delta)
+        validate_margins(margins)
+    except RequestRejected as e:
+        raise ValueError(str(e)) from None
+    page_size_name = str(job.get("page_size", "A4")).strip().lower()
+    margins = margins or DEFAULT_MARGINS
+    name = os.path.basename(str(job.get("name") or f"{index:03d}-document"))
+    return f"{name}.{fmt}", fmt, delta, page_size_name, margins
+
+
+def unique_name(name, used):
+    """Return ``name``, or ``name`` with a ``-2``, ``-3``... suffix if it is taken."""
+    stem, ext = os.path.splitext(name)
+    candidate = name
+    n = 1
+    while candidate in used:
+        n += 1
+        candidate = f"{stem}-{n}{ext}"
+    used.add(candidate)
+    return candidate
+
+
+class _ChunkSink(io.RawIOBase):
+    """Unseekable write target that hands written bytes back to the generator."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_batch(jobs, cache=None):
+    """Yield a ZIP archive of the rendered jobs chunk by chunk."""
+    sink = _ChunkSink()
+    zf = zipfile.ZipFile(sink, "w", zipfile.ZIP_STORED)
+    manifest = [None] * len(jobs)
+    futures = {}
+    used_names = set()
+
+    def add_error(index, message):
+        manifest[index] = {"index": index, "status": "failed", "error": message}
+        zf.writestr(f"errors/{index:03d}.json", json.dumps(manifest[index]))
+
+    def add_result(index, name, content):
+        manifest[index] = {"index": index, "status": "ok", "file": name, "bytes": len(content)}
+        zf.writestr(name, content)
+
+    try:
+        for index, job in enumerate(jobs):
+            try:
+                name, fmt, delta, page_size_name, margins = normalize_job(index, job)
+                key = cache_key(fmt, delta, page_size_name, margins) if cache else None
+            except (ValueError, RecursionError) as e:
+                add_error(index, str(e))
+                continue
+            name = unique_name(name, used_names)
+            content = cache.get(key) if cache else None
+            if content is not None:
+                add_result(index, name, content)
+                continue
+            try:
+                future = submit_job(fmt, delta, page_size_name, margins)
+            except Exception as e:
+                print(f"⚠️ Batch job {index} could not be queued:", e)
+                add_error(index, str(e))
+                continue
+            futures[future] = (index, name, key)
+
+        data = sink.drain()
+        if data:
+            yield data
+
+        for future in as_completed(futures):
+            index, name, key = futures[future]
+            try:
+                content = future.result()
+            except Exception as e:
+                print(f"⚠️ Batch job {index} failed:", e)
+                add_error(index, str(e))
+            else:
+                if cache:
+                    cache.put(key, content)
+                add_result(index, name, content)
+            yield sink.drain()
+
+        zf.writestr("manifest.json", json.dumps({"jobs": manifest}, indent=2))
+        zf.close()
+        yield sink.drain()
+    finally:
+        # client went away or we failed; don't keep rendering for nobody
+        for future in futures:
+            future.cancel()
@@ -0,0 +1 @@
+"""Benchmark suite for the conversion paths; run with ``python -m benchmarks.run``."""
@@ -0,0 +1,92 @@
+"""Check that concurrent renders in one process match serial ones byte for byte.
+
+Usage::
+
+    python -m benchmarks.concurrency
+    python -m benchmarks.concurrency --threads 8 --rounds 4 --scenarios small tables
+
+This is the evidence behind the gthread worker model in ``gunicorn.conf.py``:
+every corpus document is rendered once serially, with the fragment cache off,
+as the reference. All of them are then rendered again from a thread pool, each
+thread with its own mix of formats and page sizes: once with the fragment cache
+off, and once starting from an empty cache so that threads race to fill and
+copy shared fragments. PDFs are rendered with ReportLab's ``invariant`` mode
+(fixed timestamps and document ids) and DOCX files are compared part by part,
+so any difference means state leaked between concurrent renders.
+"""
+import argparse
+import sys
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from reportlab import rl_config
+
+from benchmarks.corpus import SCENARIOS, make_delta
+from document_model import compile_delta
+from fragment_cache import fragment_cache
+from renderers import RENDERERS
+
+rl_config.invariant = 1
+
+PAGE_SIZES = ("a4", "letter", "legal")
+
+
+def docx_parts(content):
+    with zipfile.ZipFile(BytesIO(content)) as archive:
+        return {name: archive.read(name) for name in archive.namelist()}
+
+
+def comparable(fmt, content):
+    return docx_parts(content) if fmt == "docx" else content
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--scenarios", nargs="+", default=["small", "fragmented", "tables"], choices=sorted(SCENARIOS))
+    parser.add_argument("--formats", nargs="+", default=sorted(RENDERERS), choices=sorted(RENDERERS))
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    cases = []
+    for name in args.scenarios:
+        model = compile_delta(make_delta(**SCENARIOS[name]))
+        for fmt in args.formats:
+            for page_size_name in PAGE_SIZES:
+                cases.append((name, fmt, page_size_name, model))
+
+    def render(case):
+        _, fmt, page_size_name, model = case
+        return comparable(fmt, RENDERERS[fmt][0](model, page_size_name))
+
+    cache_size = fragment_cache.max_bytes
+    fragment_cache.max_bytes = 0
+    start = time.perf_counter()
+    expected = [render(case) for case in cases]
+    serial = time.perf_counter() - start
+    print(f"{len(cases)} documents, serial {serial:.2f}s (fragment cache off)")
+
+    jobs = [index for _ in range(args.rounds) for index in range(len(cases))]
+    failures = 0
+    for label, max_bytes in (("fragment cache off", 0), ("fragment cache on", cache_size)):
+        fragment_cache.clear()
+        fragment_cache.max_bytes = max_bytes
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.threads) as pool:
+            results = list(pool.map(lambda index: (index, render(cases[index])), jobs))
+        concurrent = time.perf_counter() - start
+
+        mismatches = sorted({cases[index][:3] for index, result in results if result != expected[index]})
+        print(f"{len(jobs)} renders on {args.threads} threads {concurrent:.2f}s ({label})")
+        for name, fmt, page_size_name in mismatches:
+            print(f"MISMATCH {name} {fmt} {page_size_name} ({label})")
+        failures += len(mismatches)
+    fragment_cache.max_bytes = cache_size
+    print("OK" if not failures else f"{failures} mismatching documents")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+"""Synthetic Quill delta generator for benchmarks.
+
+Deltas are deterministic for a given seed and mimic real contracts: paragraphs
+split into many formatted runs, runs of bullet/ordered list items, colored and
+highlighted text, and ``custom`` tables whose cells hold nested ops and are
+doubly JSON-encoded exactly like the editor sends them.
+"""
+import json
+import random
+
+WORDS = (
+    "agreement party lessee lessor premises term rent deposit notice default "
+    "remedy assignment sublease indemnify warranty covenant schedule exhibit "
+    "payment interest liability insurance governing law jurisdiction waiver "
+    "amendment severability termination renewal obligation consent hereby"
+).split()
+COLORS = ["#E53935", "#1E88E5", "#43A047", "#FFFB8C00", "#6D4C41"]
+BACKGROUNDS = ["#FFF59D", "#E1F5FE"]
+
+
+def _sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def _inline_attrs(rng, color_ratio):
+    attrs = {}
+    roll = rng.random()
+    if roll < 0.15:
+        attrs["bold"] = True
+    elif roll < 0.25:
+        attrs["italic"] = True
+    elif roll < 0.30:
+        attrs["underline"] = True
+    if rng.random() < color_ratio:
+        attrs["color"] = rng.choice(COLORS)
+        if rng.random() < 0.2:
+            attrs["background"] = rng.choice(BACKGROUNDS)
+    return attrs
+
+
+def _runs(rng, count, words, color_ratio):
+    ops = []
+    for _ in range(count):
+        op = {"insert": _sentence(rng, words) + " "}
+        attrs = _inline_attrs(rng, color_ratio)
+        if attrs:
+            op["attributes"] = attrs
+        ops.append(op)
+    return ops
+
+
+def make_table_op(rng, rows, cols, cell_runs=2, color_ratio=0.1):
+    """A ``custom`` table embed with ``rows`` x ``cols`` cells of nested ops."""
+    columns = [f"c{i}" for i in range(cols)]
+    table_rows = []
+    for _ in range(rows):
+        table_rows.append({
+            col: _runs(rng, cell_runs, 3, color_ratio) for col in columns
+        })
+    table = {"columns": columns, "rows": table_rows}
+    return {"insert": {"custom": json.dumps({"table": json.dumps(table)})}}
+
+
+def make_delta(
+    paragraphs=100,
+    runs_per_paragraph=4,
+    words_per_run=8,
+    list_ratio=0.2,
+    color_ratio=0.1,
+    tables=0,
+    table_rows=10,
+    table_cols=4,
+    cell_runs=2,
+    seed=0,
+):
+    """Build a delta of ``paragraphs`` blocks with ``tables`` tables spread through it."""
+    rng = random.Random(seed)
+    delta = []
+    table_every = paragraphs // (tables + 1) if tables else 0
+    tables_left = tables
+    list_left = 0
+    list_type = None
+
+    for index in range(paragraphs):
+        if tables_left and table_every and index and index % table_every == 0:
+            delta.append(make_table_op(rng, table_rows, table_cols, cell_runs, color_ratio))
+            tables_left -= 1
+
+        delta.extend(_runs(rng, runs_per_paragraph, words_per_run, color_ratio))
+
+        # list items come in runs of 3-8, like numbered clauses
+        if not list_left and rng.random() < list_ratio / 5:
+            list_left = rng.randint(3, 8)
+            list_type = rng.choice(["bullet", "ordered"])
+        block_attrs = {}
+        if list_left:
+            block_attrs["list"] = list_type
+            list_left -= 1
+        elif rng.random() < 0.1:
+            block_attrs["align"] = rng.choice(["center", "right", "justify"])
+        newline = {"insert": "\n"}
+        if block_attrs:
+            newline["attributes"] = block_attrs
+        delta.append(newline)
+
+    while tables_left:
+        delta.append(make_table_op(rng, table_rows, table_cols, cell_runs, color_ratio))
+        tables_left -= 1
+    delta.append({"insert": "\n"})
+    return delta
+
+
+# Named scenarios used by the runner; values are ``make_delta`` keyword arguments.
+SCENARIOS = {
+    "small": {"paragraphs": 50},
+    "medium": {"paragraphs": 500, "runs_per_paragraph": 6, "color_ratio": 0.2},
+    "fragmented": {"paragraphs": 300, "runs_per_paragraph": 40, "words_per_run": 2, "color_ratio": 0.4},
+    "large": {"paragraphs": 3000, "runs_per_paragraph": 4},
+    "tables": {"paragraphs": 100, "tables": 5, "table_rows": 200, "table_cols": 6},
+}
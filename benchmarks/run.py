@@ -0,0 +1,210 @@
+"""Time the conversion paths over the synthetic corpus and write JSON results.
+
+Usage::
+
+    python -m benchmarks.run --out results.json
+    python -m benchmarks.run --scenarios small tables --repeat 10
+    python -m benchmarks.run --out new.json --compare results.json
+
+Each scenario is measured up to three ways: ``endpoint`` posts to the Flask
+route through the test client (request decoding, compile, render, response),
+``render`` calls ``compile_delta`` plus the renderer directly, and ``edit``
+changes one text op before each render with the fragment cache enabled, as an
+editor re-posting a document after a small edit would. The render cache is
+disabled, and the fragment cache outside ``edit``, so every sample does the
+full work. Endpoint results also carry the median of each ``Server-Timing``
+stage, so decoding, validation and rendering can be compared separately. Peak memory is measured with
+tracemalloc in a separate untimed pass; ``max_rss_kib`` is the process
+high-water mark after the scenario.
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import resource
+import sys
+import time
+import tracemalloc
+
+# every sample must render, so keep the render cache out of the way
+os.environ["RENDER_CACHE_MAX_BYTES"] = "0"
+os.environ.pop("RENDER_CACHE_DIR", None)
+
+from benchmarks.corpus import SCENARIOS, make_delta  # noqa: E402
+from document_model import compile_delta  # noqa: E402
+from fragment_cache import fragment_cache  # noqa: E402
+from renderers import RENDERERS  # noqa: E402
+
+ROUTES = {"docx": "/convert/delta-to-docx", "pdf": "/convert/delta-to-pdf"}
+MODES = ["endpoint", "render", "edit"]
+EDIT_FRAGMENT_CACHE_BYTES = 512 * 1024 * 1024
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of ``samples``."""
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def max_rss_kib():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux kilobytes
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def make_call(mode, fmt, payload, client):
+    if mode == "endpoint":
+        route = ROUTES[fmt]
+
+        body = json.dumps(payload).encode("utf-8")
+
+        def call():
+            response = client.post(route, data=body, content_type="application/json")
+            if response.status_code != 200:
+                raise RuntimeError(f"{route} returned {response.status_code}: {response.get_data(as_text=True)}")
+            call.server_timings.append(response.headers.get("Server-Timing", ""))
+            return response.data
+        call.server_timings = []
+        return call
+
+    render = RENDERERS[fmt][0]
+    if mode == "edit":
+        delta = payload["delta"]
+        text_ops = [i for i, op in enumerate(delta) if isinstance(op.get("insert"), str) and op["insert"].strip()]
+        rng = random.Random(0)
+        revision = itertools.count()
+
+        def call():
+            edited = list(delta)
+            index = rng.choice(text_ops)
+            edited[index] = {**edited[index], "insert": f"{edited[index]['insert']} rev{next(revision)}"}
+            return render(compile_delta(edited), payload["page_size"], payload["margins"])
+        return call
+
+    def call():
+        return render(compile_delta(payload["delta"]), payload["page_size"], payload["margins"])
+    return call
+
+
+def stage_medians(server_timings):
+    """Median milliseconds per stage across ``Server-Timing`` header values."""
+    stages = {}
+    for header in server_timings:
+        for entry in filter(None, (part.strip() for part in header.split(","))):
+            name, _, duration = entry.partition(";dur=")
+            if duration:
+                stages.setdefault(name, []).append(float(duration))
+    return {name: round(percentile(values, 50), 3) for name, values in stages.items()}
+
+
+def measure(call, repeat, warmup):
+    for _ in range(warmup):
+        call()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = call()
+        samples.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    call()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return samples, peak, len(output)
+
+
+def run(scenarios, formats, modes, repeat, warmup):
+    from app import app
+    client = app.test_client()
+    results = []
+    for name in scenarios:
+        delta = make_delta(**SCENARIOS[name])
+        payload = {"delta": delta, "page_size": "A4", "margins": {"top": 20, "bottom": 20, "left": 20, "right": 20}}
+        for fmt in formats:
+            for mode in modes:
+                fragment_cache.max_bytes = EDIT_FRAGMENT_CACHE_BYTES if mode == "edit" else 0
+                call = make_call(mode, fmt, payload, client)
+                samples, peak, size = measure(call, repeat, warmup)
+                mean = sum(samples) / len(samples)
+                result = {
+                    "scenario": name,
+                    "format": fmt,
+                    "mode": mode,
+                    "ops": len(delta),
+                    "samples": len(samples),
+                    "p50_ms": round(percentile(samples, 50) * 1000, 3),
+                    "p95_ms": round(percentile(samples, 95) * 1000, 3),
+                    "mean_ms": round(mean * 1000, 3),
+                    "ops_per_sec": round(len(delta) / mean, 1),
+                    "output_bytes": size,
+                    "tracemalloc_peak_kib": peak // 1024,
+                    "max_rss_kib": max_rss_kib(),
+                }
+                if mode == "endpoint":
+                    # server-side stage split, e.g. decode vs. validate vs. render
+                    result["stages_p50_ms"] = stage_medians(call.server_timings)
+                results.append(result)
+                print(
+                    f"{name:<12} {fmt:<5} {mode:<9} p50 {result['p50_ms']:>10.2f} ms  "
+                    f"p95 {result['p95_ms']:>10.2f} ms  {result['ops_per_sec']:>10.1f} ops/s  "
+                    f"peak {result['tracemalloc_peak_kib']:>8} KiB"
+                )
+    return results
+
+
+def compare(results, baseline_path):
+    """Print p50/p95 change against an earlier results file."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {
+            (r["scenario"], r["format"], r["mode"]): r for r in json.load(f)["results"]
+        }
+    print(f"\nCompared with {baseline_path}:")
+    for result in results:
+        old = baseline.get((result["scenario"], result["format"], result["mode"]))
+        if old is None:
+            continue
+        changes = []
+        for metric in ("p50_ms", "p95_ms", "tracemalloc_peak_kib"):
+            before, after = old[metric], result[metric]
+            pct = (after - before) / before * 100 if before else 0.0
+            changes.append(f"{metric} {before} -> {after} ({pct:+.1f}%)")
+        print(f"{result['scenario']:<12} {result['format']:<5} {result['mode']:<9} " + "  ".join(changes))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--formats", nargs="+", choices=sorted(RENDERERS), default=sorted(RENDERERS))
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--repeat", type=int, default=5, help="timed samples per scenario")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed runs before sampling")
+    parser.add_argument("--out", help="write results as JSON to this path")
+    parser.add_argument("--compare", metavar="BASELINE", help="compare against an earlier --out file")
+    args = parser.parse_args(argv)
+
+    results = run(args.scenarios, args.formats, args.modes, max(1, args.repeat), args.warmup)
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "repeat": args.repeat,
+        },
+        "scenarios": {name: SCENARIOS[name] for name in args.scenarios},
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.out}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
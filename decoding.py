@@ -0,0 +1,232 @@
+"""Request body decoding and structural validation of deltas.
+
+Bodies are decoded with orjson when it is installed and the standard ``json``
+module otherwise. ``validate_delta`` then walks the delta once, checking its
+shape against the configured limits and decoding the doubly encoded ``custom``
+table embeds on the way, so compilation does not parse them a second time.
+``validate_margins`` and ``validate_variables`` check the other client values
+that reach the renderers and the cache key.
+
+Problems are raised as ``RequestRejected`` with the HTTP status to return: 400
+for a body that is not JSON, 413 when a size limit is exceeded and 422 for a
+delta with the wrong structure.
+"""
+import json
+import os
+
+from werkzeug.exceptions import RequestEntityTooLarge
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+MAX_REQUEST_BYTES = int(os.environ.get("MAX_REQUEST_BYTES", 32 * 1024 * 1024))
+MAX_DELTA_OPS = int(os.environ.get("MAX_DELTA_OPS", 200_000))
+MAX_TABLE_ROWS = int(os.environ.get("MAX_TABLE_ROWS", 10_000))
+MAX_TABLE_COLS = int(os.environ.get("MAX_TABLE_COLS", 64))
+# depth of op attributes and embed values (an embed object itself is depth 1)
+MAX_NESTING = int(os.environ.get("MAX_NESTING", 8))
+# largest page margin; together with the frame padding it still leaves room on A4
+MAX_MARGIN = float(os.environ.get("MAX_MARGIN", 200))
+
+# attributes the renderers use as style keys and colors; they must be scalars
+SCALAR_ATTRIBUTES = ("align", "list", "color", "background")
+MARGIN_SIDES = ("top", "bottom", "left", "right")
+
+
+class RequestRejected(Exception):
+    """Raised for a request body that will not be rendered; ``status`` is the HTTP code."""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+def loads(data):
+    """Decode JSON text or bytes with the fastest available parser."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def read_json_body(request):
+    """Read and decode a request body; returns None for an empty one.
+
+    The size limit itself is enforced by werkzeug through the app's
+    ``MAX_CONTENT_LENGTH``.
+    """
+    try:
+        body = request.get_data(cache=False)
+    except RequestEntityTooLarge:
+        raise RequestRejected(f"Request body exceeds {MAX_REQUEST_BYTES} bytes", 413) from None
+    if not body.strip():
+        return None
+    try:
+        return loads(body)
+    except (ValueError, RecursionError) as e:
+        raise RequestRejected(f"Request body is not valid JSON: {e}", 400) from None
+
+
+def _too_deep(value, limit):
+    stack = [(value, 1)]
+    while stack:
+        item, depth = stack.pop()
+        if isinstance(item, dict):
+            children = item.values()
+        elif isinstance(item, list):
+            children = item
+        else:
+            continue
+        if depth > limit:
+            return True
+        stack.extend((child, depth + 1) for child in children)
+    return False
+
+
+def _check_attributes(attributes, where):
+    if attributes is None:
+        return
+    if not isinstance(attributes, dict):
+        raise RequestRejected(f"{where}: attributes must be an object", 422)
+    if _too_deep(attributes, MAX_NESTING):
+        raise RequestRejected(f"{where}: attributes nested deeper than {MAX_NESTING}", 422)
+    for name in SCALAR_ATTRIBUTES:
+        if isinstance(attributes.get(name), (dict, list)):
+            raise RequestRejected(f"{where}: attribute {name!r} must be a scalar", 422)
+
+
+def _check_op_depth(op, where):
+    """Check an op's attributes, then the depth of the whole op (which is depth 1)."""
+    _check_attributes(op.get("attributes"), where)
+    if _too_deep(op, MAX_NESTING + 1):
+        raise RequestRejected(f"{where}: op nested deeper than {MAX_NESTING}", 422)
+
+
+def _without_table(op):
+    # a custom table is checked on its own, against limits that allow for its cells
+    insert = op.get("insert")
+    custom = insert.get("custom") if isinstance(insert, dict) else None
+    if isinstance(custom, dict) and "table" in custom:
+        return {**op, "insert": {**insert, "custom": {**custom, "table": None}}}
+    return op
+
+
+def _decode_embedded(value, where):
+    if not isinstance(value, (str, bytes)):
+        return value
+    try:
+        return loads(value)
+    except (ValueError, RecursionError):
+        raise RequestRejected(f"{where}: embedded JSON is invalid", 422) from None
+
+
+def _validate_table(table, where):
+    """Check a decoded table payload against the size limits."""
+    if not isinstance(table, dict):
+        raise RequestRejected(f"{where}: table must be an object", 422)
+    columns = table.get("columns", [])
+    rows = table.get("rows", [])
+    if not isinstance(columns, list) or not isinstance(rows, list):
+        raise RequestRejected(f"{where}: table columns and rows must be lists", 422)
+    if not columns:
+        raise RequestRejected(f"{where}: table has no columns", 422)
+    header = table.get("headerRows", table.get("header_rows"))
+    if header is not None:
+        try:
+            int(header)
+        except (TypeError, ValueError):
+            raise RequestRejected(f"{where}: table headerRows must be a number", 422) from None
+    if len(columns) > MAX_TABLE_COLS:
+        raise RequestRejected(f"{where}: table has {len(columns)} columns, the limit is {MAX_TABLE_COLS}", 413)
+    if len(rows) > MAX_TABLE_ROWS:
+        raise RequestRejected(f"{where}: table has {len(rows)} rows, the limit is {MAX_TABLE_ROWS}", 413)
+    # cell op attributes sit five levels down: table, rows, row, cell, op
+    if _too_deep(table, MAX_NESTING + 5):
+        raise RequestRejected(f"{where}: table nested deeper than its cells allow", 422)
+    for column in columns:
+        if not isinstance(column, (str, int, float, bool)) and column is not None:
+            raise RequestRejected(f"{where}: table column names must be scalars", 422)
+    for row_index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            raise RequestRejected(f"{where}: table row {row_index} must be an object", 422)
+        for column in columns:
+            cell = row.get(column, [])
+            if not isinstance(cell, list):
+                raise RequestRejected(f"{where}: table cell {row_index}/{column} must be a list of ops", 422)
+            for cell_op in cell:
+                if not isinstance(cell_op, dict):
+                    raise RequestRejected(f"{where}: table cell {row_index}/{column} has a non-object op", 422)
+                _check_op_depth(cell_op, f"{where}: table cell {row_index}/{column}")
+
+
+def _flat_attributes(attributes):
+    if attributes is None:
+        return True
+    return isinstance(attributes, dict) and not any(
+        isinstance(value, (dict, list)) for value in attributes.values()
+    )
+
+
+def validate_op(op, index):
+    """Check one op and return it, with any ``custom`` table embed decoded."""
+    # fast path: the vast majority of ops are text with flat attributes and nothing else
+    if (isinstance(op, dict) and isinstance(op.get("insert"), str) and len(op) == 1 + ("attributes" in op)
+            and _flat_attributes(op.get("attributes"))):
+        return op
+    where = f"op {index}"
+    if not isinstance(op, dict):
+        raise RequestRejected(f"{where} is not an object", 422)
+    insert = op.get("insert")
+    _check_op_depth(_without_table(op), where)
+    if isinstance(insert, str):
+        return op
+    if not isinstance(insert, dict):
+        if "retain" in op or "delete" in op:
+            raise RequestRejected(f"{where} is not an insert; post change-deltas to /documents/<id>/changes", 422)
+        raise RequestRejected(f"{where} must insert text or an embed", 422)
+
+    custom = insert.get("custom")
+    if custom is None:
+        return op
+    custom = _decode_embedded(custom, where)
+    if not isinstance(custom, dict):
+        raise RequestRejected(f"{where}: custom embed must be an object", 422)
+    table = _decode_embedded(custom.get("table"), where)
+    if table:
+        _validate_table(table, where)
+    return {**op, "insert": {**insert, "custom": {**custom, "table": table}}}
+
+
+def validate_delta(delta):
+    """Validate a whole delta in one pass; returns it with table embeds decoded.
+
+    The input is not modified, so it can still be hashed or stored as sent.
+    """
+    if not isinstance(delta, list):
+        raise RequestRejected("delta must be a list of ops", 422)
+    if len(delta) > MAX_DELTA_OPS:
+        raise RequestRejected(f"delta has {len(delta)} ops, the limit is {MAX_DELTA_OPS}", 413)
+    return [validate_op(op, index) for index, op in enumerate(delta)]
+
+
+def validate_margins(margins):
+    """Check page margins: None, or an object of non-negative numbers per side."""
+    if margins is None:
+        return
+    if not isinstance(margins, dict):
+        raise RequestRejected("margins must be an object", 422)
+    for side in MARGIN_SIDES:
+        value = margins.get(side, 0)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise RequestRejected(f"margins.{side} must be a number", 422)
+        if not 0 <= value <= MAX_MARGIN:
+            raise RequestRejected(f"margins.{side} must be between 0 and {MAX_MARGIN:g}", 422)
+
+
+def validate_variables(variables):
+    """Check template variables are an object within the nesting limit."""
+    if not isinstance(variables, dict):
+        raise RequestRejected("variables must be an object", 422)
+    if _too_deep(variables, MAX_NESTING):
+        raise RequestRejected(f"variables nested deeper than {MAX_NESTING}", 422)
@@ -0,0 +1,194 @@
+"""Apply Quill change-deltas to stored documents.
+
+``compose`` is a port of quill-delta's ``Delta.compose`` restricted to what the
+service needs: the first argument is a document (inserts only) and the result
+must be one as well. Lengths and offsets are counted in UTF-16 code units, as
+Quill counts them in the browser, and embeds (including ``custom`` tables)
+have length 1.
+"""
+import math
+
+
+def utf16_length(text):
+    """Length of ``text`` the way Quill counts it."""
+    if text.isascii():
+        return len(text)
+    return len(text.encode("utf-16-le", "surrogatepass")) // 2
+
+
+def _utf16_slice(text, start, end):
+    if text.isascii():
+        return text[start:end]
+    data = text.encode("utf-16-le", "surrogatepass")
+    return data[2 * start:2 * end].decode("utf-16-le", "surrogatepass")
+
+
+def op_length(op):
+    if "delete" in op:
+        return op["delete"]
+    if "retain" in op:
+        return op["retain"]
+    insert = op["insert"]
+    return utf16_length(insert) if isinstance(insert, str) else 1
+
+
+def validate_change(change):
+    """Raise ValueError unless ``change`` is a list of well-formed delta ops."""
+    if not isinstance(change, list):
+        raise ValueError("change must be a list of ops")
+    for index, op in enumerate(change):
+        if not isinstance(op, dict):
+            raise ValueError(f"change op {index} is not an object")
+        kinds = [kind for kind in ("insert", "retain", "delete") if kind in op]
+        if len(kinds) != 1:
+            raise ValueError(f"change op {index} needs exactly one of insert, retain or delete")
+        kind = kinds[0]
+        value = op[kind]
+        if kind == "insert":
+            if not isinstance(value, (str, dict)):
+                raise ValueError(f"change op {index} inserts neither text nor an embed")
+        elif isinstance(value, bool) or not isinstance(value, int) or value < 0:
+            raise ValueError(f"change op {index} has an invalid {kind} length")
+        attributes = op.get("attributes")
+        if attributes is not None and not isinstance(attributes, dict):
+            raise ValueError(f"change op {index} has invalid attributes")
+
+
+def compose_attributes(a, b, keep_null):
+    attributes = {**(a or {}), **(b or {})}
+    if not keep_null:
+        attributes = {key: value for key, value in attributes.items() if value is not None}
+    return attributes or None
+
+
+class _OpIterator:
+    """Walks a list of ops in pieces of arbitrary length."""
+
+    def __init__(self, ops):
+        self.ops = ops
+        self.index = 0
+        self.offset = 0
+
+    def has_next(self):
+        return self.peek_length() < math.inf
+
+    def peek_length(self):
+        if self.index < len(self.ops):
+            return op_length(self.ops[self.index]) - self.offset
+        return math.inf
+
+    def peek_type(self):
+        if self.index < len(self.ops):
+            op = self.ops[self.index]
+            if "delete" in op:
+                return "delete"
+            if "retain" in op:
+                return "retain"
+            return "insert"
+        return "retain"
+
+    def next(self, length=math.inf):
+        if self.index >= len(self.ops):
+            return {"retain": math.inf}
+        op = self.ops[self.index]
+        offset = self.offset
+        remaining = op_length(op) - offset
+        if length >= remaining:
+            length = remaining
+            self.index += 1
+            self.offset = 0
+        else:
+            self.offset += length
+        if "delete" in op:
+            return {"delete": length}
+        if "retain" in op:
+            piece = {"retain": length}
+        elif isinstance(op["insert"], str):
+            piece = {"insert": _utf16_slice(op["insert"], offset, offset + length)}
+        else:
+            piece = {"insert": op["insert"]}
+        if op.get("attributes"):
+            piece["attributes"] = op["attributes"]
+        return piece
+
+    def rest(self):
+        """The remaining ops; the current one is cut at the offset if needed."""
+        if self.index >= len(self.ops):
+            return []
+        if self.offset:
+            return [self.next()] + self.ops[self.index:]
+        return self.ops[self.index:]
+
+
+def _push(ops, op):
+    # never mutate an op in place: it may belong to the stored document
+    if ops:
+        last = ops[-1]
+        if "delete" in op and "delete" in last:
+            ops[-1] = {"delete": last["delete"] + op["delete"]}
+            return
+        if last.get("attributes") == op.get("attributes"):
+            if isinstance(last.get("insert"), str) and isinstance(op.get("insert"), str):
+                ops[-1] = {**last, "insert": last["insert"] + op["insert"]}
+                return
+            if "retain" in last and "retain" in op:
+                ops[-1] = {**last, "retain": last["retain"] + op["retain"]}
+                return
+    ops.append(op)
+
+
+def compose(document, change):
+    """Return the document ops that result from applying ``change`` to ``document``.
+
+    Raises ValueError if ``change`` is malformed or reaches past the end of the
+    document.
+    """
+    validate_change(change)
+    # Quill treats zero-length retains and deletes as no-ops; the iterators
+    # would not advance past them
+    change = [op for op in change if "insert" in op or op_length(op)]
+    this_iter = _OpIterator(document)
+    other_iter = _OpIterator(change)
+    ops = []
+
+    # copy the untouched head of the document wholesale
+    if change and "retain" in change[0] and not change[0].get("attributes"):
+        head = change[0]["retain"]
+        while this_iter.peek_type() == "insert" and this_iter.peek_length() <= head:
+            head -= this_iter.peek_length()
+            ops.append(document[this_iter.index])
+            this_iter.index += 1
+        if change[0]["retain"] - head > 0:
+            other_iter.next(change[0]["retain"] - head)
+
+    while this_iter.has_next() or other_iter.has_next():
+        if other_iter.peek_type() == "insert":
+            _push(ops, other_iter.next())
+        elif this_iter.peek_type() == "delete":
+            _push(ops, this_iter.next())
+        elif not other_iter.has_next():
+            # and the untouched tail
+            rest = this_iter.rest()
+            _push(ops, rest[0])
+            ops.extend(rest[1:])
+            break
+        else:
+            length = min(this_iter.peek_length(), other_iter.peek_length())
+            this_op = this_iter.next(length)
+            other_op = other_iter.next(length)
+            if "retain" in other_op:
+                new_op = {"retain": length} if "retain" in this_op else {"insert": this_op["insert"]}
+                attributes = compose_attributes(
+                    this_op.get("attributes"), other_op.get("attributes"), "retain" in this_op
+                )
+                if attributes:
+                    new_op["attributes"] = attributes
+                _push(ops, new_op)
+            elif "delete" in other_op and "retain" in this_op:
+                _push(ops, other_op)
+
+    if ops and "retain" in ops[-1] and not ops[-1].get("attributes"):
+        ops.pop()
+    if any("insert" not in op for op in ops):
+        raise ValueError("change reaches past the end of the document")
+    return ops
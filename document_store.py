@@ -0,0 +1,117 @@
+"""Stored documents that editors send Quill change-deltas against.
+
+A client registers the full delta once and afterwards posts only the
+change-delta of each edit. Documents are immutable and content-addressed:
+applying a change stores the result as a new document whose id is returned to
+the client, so every worker resolves the same id to the same ops. Sources live
+in ``DOCUMENT_DIR`` (shared between workers) and are removed after
+``DOCUMENT_TTL`` seconds without being written.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from delta_compose import compose
+
+DOCUMENT_DIR = os.environ.get("DOCUMENT_DIR") or os.path.join(tempfile.gettempdir(), "legallyai-documents")
+DOCUMENT_CACHE_SIZE = int(os.environ.get("DOCUMENT_CACHE_SIZE", 64))
+DOCUMENT_TTL = int(os.environ.get("DOCUMENT_TTL", 24 * 3600))
+PRUNE_INTERVAL = 300
+
+
+def document_id_for(delta):
+    canonical = json.dumps(delta, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8", "surrogatepass")).hexdigest()[:32]
+
+
+def validate_document(delta):
+    """Raise ValueError unless ``delta`` is a list of insert ops."""
+    if not isinstance(delta, list):
+        raise ValueError("delta must be a list of ops")
+    for index, op in enumerate(delta):
+        if not isinstance(op, dict) or not isinstance(op.get("insert"), (str, dict)):
+            raise ValueError(f"document op {index} is not an insert")
+
+
+class DocumentStore:
+    """Document sources on disk plus a bounded per-process cache of recent ones."""
+
+    def __init__(self, directory=DOCUMENT_DIR, max_cached=DOCUMENT_CACHE_SIZE, ttl=DOCUMENT_TTL):
+        self.directory = directory
+        self.max_cached = max_cached
+        self.ttl = ttl
+        self._cached = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, document_id):
+        return os.path.join(self.directory, f"{document_id}.json")
+
+    def put(self, delta):
+        """Store a document and return its id."""
+        validate_document(delta)
+        document_id = document_id_for(delta)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(delta, f, ensure_ascii=False)
+        os.replace(tmp_path, self._path(document_id))
+        self._remember(document_id, delta)
+        self._maybe_prune()
+        return document_id
+
+    def get(self, document_id):
+        """Return the document's ops, or None if it is unknown or expired."""
+        if not re.fullmatch(r"[0-9a-f]{32}", document_id):
+            return None
+        with self._lock:
+            delta = self._cached.get(document_id)
+            if delta is not None:
+                self._cached.move_to_end(document_id)
+                return delta
+        try:
+            with open(self._path(document_id), encoding="utf-8") as f:
+                delta = json.load(f)
+        except OSError:
+            return None
+        self._remember(document_id, delta)
+        return delta
+
+    def apply(self, document_id, change):
+        """Apply a change-delta; returns the new document's ops or None if the base is unknown.
+
+        Nothing is stored: the caller checks the result and ``put``s it.
+        Raises ValueError for a malformed change.
+        """
+        base = self.get(document_id)
+        if base is None:
+            return None
+        return compose(base, change)
+
+    def _remember(self, document_id, delta):
+        with self._lock:
+            self._cached[document_id] = delta
+            self._cached.move_to_end(document_id)
+            while len(self._cached) > self.max_cached:
+                self._cached.popitem(last=False)
+
+    def _maybe_prune(self):
+        now = time.time()
+        if now - self._last_prune < PRUNE_INTERVAL:
+            return
+        self._last_prune = now
+        cutoff = now - self.ttl
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+        with self._lock:
+            for document_id in [d for d in self._cached if not os.path.exists(self._path(d))]:
+                del self._cached[document_id]
@@ -0,0 +1,41 @@
+"""gunicorn settings: ``gunicorn -c gunicorn.conf.py wsgi:app``.
+
+Worker model: ``workers`` processes, each with ``threads`` request threads
+(gthread). Rendering is CPU-bound and holds the GIL, so processes provide the
+parallelism and threads only overlap I/O (request bodies, cache disk reads,
+streaming responses). Within a worker, renders share the style registry and
+the pristine ``Document`` (both guarded by locks) but build every document,
+stylesheet copy and ReportLab doc template per request; see
+``benchmarks/concurrency.py`` for the check that concurrent renders produce
+the same bytes as serial ones.
+
+The caches, stores and job queue in ``app.py`` are built in the master during
+preload, while they are still empty and own no threads or connections, so each
+worker ends up with its own independent copy. Job threads and the batch
+process pool are started lazily on first use, inside the worker.
+"""
+import multiprocessing
+import os
+
+wsgi_app = "wsgi:app"
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+preload_app = True
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+# batch.py sizes each worker's render pool from this, before the app is preloaded
+os.environ["WEB_CONCURRENCY"] = str(workers)
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+graceful_timeout = 30
+keepalive = 5
+
+
+def when_ready(server):
+    import serving
+
+    state = serving.readiness()
+    server.log.info(
+        "Preloaded and warmed in %.3fs (warm-up %ss, status %s)",
+        state["uptime_seconds"], state["warmup_seconds"], state["status"],
+    )
@@ -0,0 +1,273 @@
+"""Asynchronous render jobs with progress polling.
+
+``POST /jobs`` enqueues a render on a background thread pool and returns at
+once; ``GET /jobs/<id>`` reports status and progress (ops processed, pages laid
+out). Job state lives in SQLite and finished artifacts in ``JOBS_DIR`` so any
+worker on the host can answer a poll, and both are removed after ``JOB_TTL``.
+
+The executor itself lives in one worker's memory. Each worker stamps its
+queued and running jobs with a heartbeat, and jobs whose worker has stopped
+beating (restarted, killed on timeout, redeployed) are marked failed after
+``JOB_STALE_AFTER`` seconds instead of counting against their client forever.
+"""
+import os
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from document_model import DocumentModel, iter_nodes
+from renderers import RENDERERS
+
+JOBS_DIR = os.environ.get("JOBS_DIR") or os.path.join(tempfile.gettempdir(), "legallyai-jobs")
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", 32))
+JOB_CLIENT_LIMIT = int(os.environ.get("JOB_CLIENT_LIMIT", 4))
+JOB_TTL = int(os.environ.get("JOB_TTL", 3600))
+JOB_STALE_AFTER = int(os.environ.get("JOB_STALE_AFTER", 60))
+
+# how often a running job writes its progress back to the store
+PROGRESS_INTERVAL = 0.5
+# heartbeats per JOB_STALE_AFTER, so a late one or two do not fail a live job
+HEARTBEATS_PER_STALE = 4
+CLEANUP_INTERVAL = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    client TEXT NOT NULL,
+    format TEXT NOT NULL,
+    status TEXT NOT NULL,
+    ops_total INTEGER NOT NULL,
+    ops_processed INTEGER NOT NULL DEFAULT 0,
+    pages INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    artifact TEXT,
+    created_at REAL NOT NULL,
+    finished_at REAL,
+    expires_at REAL NOT NULL,
+    owner TEXT,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_client_status ON jobs (client, status);
+"""
+
+ACTIVE_STATUSES = ("queued", "running")
+# columns added after the first release, for tables created before them
+ADDED_COLUMNS = {"owner": "TEXT", "updated_at": "REAL"}
+STALE_ERROR = "the worker running this job stopped before it finished"
+
+
+def current_owner():
+    """Identifies this worker process in the ``owner`` column."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobRejected(Exception):
+    """Raised when a job cannot be queued; ``status`` is the HTTP code to return."""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+class JobStore:
+    """SQLite-backed job table plus a directory of finished artifacts."""
+
+    def __init__(self, directory=JOBS_DIR, ttl=JOB_TTL, stale_after=JOB_STALE_AFTER):
+        self.directory = directory
+        self.ttl = ttl
+        self.stale_after = stale_after
+        self.db_path = os.path.join(directory, "jobs.sqlite3")
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            existing = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for name, kind in ADDED_COLUMNS.items():
+                if name not in existing:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {kind}")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def create(self, job_id, client, fmt, ops_total, owner, client_limit):
+        """Insert a queued job unless ``client`` already has ``client_limit`` live ones.
+
+        The count and the insert are one statement, so concurrent requests
+        cannot both slip under the limit. Returns whether the job was created.
+        """
+        now = time.time()
+        active = ", ".join("?" * len(ACTIVE_STATUSES))
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO jobs (id, client, format, status, ops_total, created_at, expires_at, owner, updated_at)"
+                " SELECT ?, ?, ?, 'queued', ?, ?, ?, ?, ?"
+                f" WHERE (SELECT COUNT(*) FROM jobs WHERE client = ? AND status IN ({active})"
+                " AND COALESCE(updated_at, created_at) >= ?) < ?",
+                (job_id, client, fmt, ops_total, now, now + self.ttl, owner, now,
+                 client, *ACTIVE_STATUSES, now - self.stale_after, client_limit),
+            )
+            return cursor.rowcount == 1
+
+    def update(self, job_id, **fields):
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def heartbeat(self, owner):
+        """Mark the live jobs of ``owner`` as still being worked on."""
+        active = ", ".join("?" * len(ACTIVE_STATUSES))
+        with self._connect() as conn:
+            conn.execute(
+                f"UPDATE jobs SET updated_at = ? WHERE owner = ? AND status IN ({active})",
+                (time.time(), owner, *ACTIVE_STATUSES),
+            )
+
+    def fail_stale(self):
+        """Mark queued and running jobs without a recent heartbeat as failed."""
+        now = time.time()
+        active = ", ".join("?" * len(ACTIVE_STATUSES))
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished_at = ?, expires_at = ?"
+                f" WHERE status IN ({active}) AND COALESCE(updated_at, created_at) < ?",
+                (STALE_ERROR, now, now + self.ttl, *ACTIVE_STATUSES, now - self.stale_after),
+            ).rowcount
+
+    def artifact_path(self, job_id, fmt):
+        return os.path.join(self.directory, f"{job_id}.{fmt}")
+
+    def cleanup(self):
+        """Fail orphaned jobs, then delete expired jobs and their artifacts.
+
+        Queued and running jobs are never removed; their expiry is pushed back
+        to ``ttl`` seconds after they finish, or after they are found stale.
+        """
+        self.fail_stale()
+        now = time.time()
+        active = ", ".join("?" * len(ACTIVE_STATUSES))
+        where = f"expires_at < ? AND status NOT IN ({active})"
+        with self._connect() as conn:
+            expired = conn.execute(
+                f"SELECT id, artifact FROM jobs WHERE {where}", (now, *ACTIVE_STATUSES)
+            ).fetchall()
+            conn.execute(f"DELETE FROM jobs WHERE {where}", (now, *ACTIVE_STATUSES))
+        for row in expired:
+            if row["artifact"]:
+                try:
+                    os.remove(row["artifact"])
+                except OSError:
+                    pass
+        return len(expired)
+
+
+class JobQueue:
+    """Bounded background executor with a per-client concurrency limit."""
+
+    def __init__(self, store, workers=JOB_WORKERS, queue_size=JOB_QUEUE_SIZE, client_limit=JOB_CLIENT_LIMIT):
+        self.store = store
+        self.queue_size = queue_size
+        self.client_limit = client_limit
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="render-job")
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._last_cleanup = 0.0
+        self._heartbeat = None
+
+    def submit(self, client, fmt, delta, page_size_name, margins):
+        """Queue a render and return its job id, or raise ``JobRejected``."""
+        self.maybe_cleanup()
+        with self._lock:
+            if self._pending >= self.queue_size:
+                raise JobRejected("Job queue is full, retry later", 503)
+            self._pending += 1
+            self._start_heartbeat()
+
+        job_id = uuid.uuid4().hex
+        try:
+            if not self.store.create(job_id, client, fmt, len(delta), current_owner(), self.client_limit):
+                raise JobRejected(f"Too many active jobs for this client (max {self.client_limit})", 429)
+            self._executor.submit(self._run, job_id, fmt, delta, page_size_name, margins)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        return job_id
+
+    def _start_heartbeat(self):
+        # called with self._lock held; the thread exits once no jobs are pending
+        if self._heartbeat is None:
+            self._heartbeat = threading.Thread(target=self._beat, name="render-job-heartbeat", daemon=True)
+            self._heartbeat.start()
+
+    def _beat(self):
+        owner = current_owner()
+        while True:
+            time.sleep(self.store.stale_after / HEARTBEATS_PER_STALE)
+            with self._lock:
+                if not self._pending:
+                    self._heartbeat = None
+                    return
+            try:
+                self.store.heartbeat(owner)
+            except sqlite3.Error as e:
+                print("⚠️ Job heartbeat failed:", e)
+
+    def maybe_cleanup(self):
+        now = time.time()
+        if now - self._last_cleanup < CLEANUP_INTERVAL:
+            return
+        self._last_cleanup = now
+        try:
+            self.store.cleanup()
+        except sqlite3.Error as e:
+            print("⚠️ Job cleanup failed:", e)
+
+    def _run(self, job_id, fmt, delta, page_size_name, margins):
+        store = self.store
+        progress = {"ops_processed": 0, "pages": 0}
+        last_flush = [time.monotonic()]
+
+        def flush(force=False):
+            now = time.monotonic()
+            if force or now - last_flush[0] >= PROGRESS_INTERVAL:
+                last_flush[0] = now
+                store.update(job_id, ops_processed=progress["ops_processed"], pages=progress["pages"])
+
+        def counted_ops():
+            for op in delta:
+                yield op
+                progress["ops_processed"] += 1
+                flush()
+
+        try:
+            store.update(job_id, status="running", updated_at=time.time())
+            # nodes are compiled lazily, so ops_processed advances with layout
+            model = DocumentModel(iter_nodes(counted_ops()), len(delta))
+            content = RENDERERS[fmt][0](model, page_size_name, margins, stats=progress)
+            path = store.artifact_path(job_id, fmt)
+            with open(path, "wb") as f:
+                f.write(content)
+            flush(force=True)
+            finished = time.time()
+            store.update(job_id, status="done", artifact=path, finished_at=finished,
+                         expires_at=finished + store.ttl)
+        except Exception as e:
+            print(f"❌ Job {job_id} failed:", e)
+            finished = time.time()
+            store.update(job_id, status="failed", error=str(e), finished_at=finished,
+                         expires_at=finished + store.ttl)
+        finally:
+            with self._lock:
+                self._pending -= 1
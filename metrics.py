@@ -0,0 +1,152 @@
+"""Stage timing, Prometheus-style histograms and per-request profiling.
+
+Wrap any step of a conversion in ``with stage("name"):``. Inside a request the
+elapsed time is added to that request's ``Server-Timing`` header, and every
+observation (including ones from background jobs) feeds a latency histogram
+labelled by route and stage, exposed in Prometheus text format at ``/metrics``.
+Histograms are per process; with several gunicorn workers each one reports its
+own share.
+
+When the operator sets ``PROFILING_ENABLED=1``, adding ``?profile=1`` to a
+request runs it under cProfile and returns the profile summary as JSON instead
+of the normal response body. It is off by default: profiled requests bypass
+the render cache and the summary exposes server source paths.
+"""
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, jsonify, request
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "0") in ("1", "true", "yes")
+PROFILE_LIMIT = int(os.environ.get("PROFILE_LIMIT", 40))
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram."""
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.sum += seconds
+        self.count += 1
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+
+
+class MetricsRegistry:
+    """Histograms of stage latency keyed by ``(route, stage)``."""
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, route, stage_name, seconds):
+        key = (route, stage_name)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def render_prometheus(self, gauges=None):
+        """Return all histograms (and optional extra gauges) in Prometheus text format."""
+        name = "legallyai_stage_duration_seconds"
+        lines = [
+            f"# HELP {name} Time spent in each conversion stage.",
+            f"# TYPE {name} histogram",
+        ]
+        with self._lock:
+            items = sorted(self._histograms.items())
+            for (route, stage_name), histogram in items:
+                labels = f'route="{route}",stage="{stage_name}"'
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f"{name}_sum{{{labels}}} {histogram.sum:.6f}")
+                lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+        for gauge_name, (help_text, value) in sorted((gauges or {}).items()):
+            lines.append(f"# HELP {gauge_name} {help_text}")
+            lines.append(f"# TYPE {gauge_name} gauge")
+            lines.append(f"{gauge_name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+def current_route():
+    if has_request_context():
+        rule = request.url_rule
+        return rule.rule if rule is not None else request.path
+    return "background"
+
+
+@contextmanager
+def stage(name):
+    """Time a block and record it under ``name`` for the current route."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.observe(current_route(), name, elapsed)
+        if has_request_context():
+            timings = g.setdefault("stage_timings", {})
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def start_request():
+    """``before_request`` hook: start the clock and, if asked, the profiler."""
+    g.request_start = time.perf_counter()
+    if PROFILING_ENABLED and request.args.get("profile") == "1":
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+def profiling_active():
+    """True while the current request is being profiled."""
+    return has_request_context() and "profiler" in g
+
+
+def server_timing(timings, total):
+    entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items()]
+    entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries)
+
+
+def finish_request(response):
+    """``after_request`` hook: record totals, add Server-Timing, swap in the profile."""
+    start = g.pop("request_start", None)
+    if start is None:
+        return response
+    total = time.perf_counter() - start
+    timings = g.pop("stage_timings", {})
+    if request.url_rule is not None:
+        metrics.observe(current_route(), "total", total)
+    response.headers["Server-Timing"] = server_timing(timings, total)
+
+    profiler = g.pop("profiler", None)
+    if profiler is None:
+        return response
+    profiler.disable()
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(PROFILE_LIMIT)
+    profiled = jsonify({
+        "status": response.status_code,
+        "server_timing": {name: round(seconds * 1000, 3) for name, seconds in timings.items()},
+        "total_ms": round(total * 1000, 3),
+        "profile": out.getvalue(),
+    })
+    profiled.headers["Server-Timing"] = response.headers["Server-Timing"]
+    return profiled
@@ -0,0 +1,202 @@
+"""Content-addressed cache for rendered documents.
+
+Rendered bytes are keyed on a SHA-256 of the canonical request payload, so the
+same delta, format, page size and margins always map to the same entry (PDF
+keys also cover the configured fonts, letterhead and compression). A bounded
+in-memory LRU tier sits in front of an optional on-disk tier that can be
+shared by every gunicorn worker on the host.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from assets import asset_registry
+from renderers import DEFAULT_MARGINS, resolve_page_size
+
+# Bump whenever renderer output changes so stale disk entries are not served.
+CACHE_VERSION = 8
+# seconds between full scans of the disk tier, which other workers also fill
+DISK_SCAN_INTERVAL = 60
+# a prune goes down to this share of the limit so the next one is not on the next write
+DISK_PRUNE_TARGET = 0.9
+
+
+def cache_key(fmt, delta, page_size_name, margins):
+    """Return the hex digest identifying one render request."""
+    payload = {
+        "v": CACHE_VERSION,
+        "format": fmt,
+        "page_size": resolve_page_size(page_size_name),
+        "margins": {**DEFAULT_MARGINS, **(margins or {})},
+        "delta": delta,
+    }
+    if fmt == "pdf":
+        payload["assets"] = asset_registry.fingerprint
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class RenderCache:
+    """Two-tier (memory LRU + optional disk) store of rendered bytes."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_entries=512, disk_dir=None, disk_max_bytes=None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # running estimate of the disk tier's size; None until the first scan
+        self._disk_bytes = None
+        self._last_disk_scan = 0.0
+        self._prune_lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+        """Build a cache configured from RENDER_CACHE_* environment variables."""
+        disk_max = os.environ.get("RENDER_CACHE_DISK_MAX_BYTES")
+        return cls(
+            max_bytes=int(os.environ.get("RENDER_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+            max_entries=int(os.environ.get("RENDER_CACHE_MAX_ENTRIES", 512)),
+            disk_dir=os.environ.get("RENDER_CACHE_DIR") or None,
+            disk_max_bytes=int(disk_max) if disk_max else None,
+        )
+
+    def get(self, key):
+        """Return cached bytes for ``key`` or None, promoting disk hits to memory."""
+        with self._lock:
+            content = self._entries.get(key)
+            if content is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return content
+
+        content = self._read_disk(key)
+        with self._lock:
+            if content is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._store(key, content)
+        return content
+
+    def put(self, key, content):
+        """Store ``content`` under ``key`` in both tiers."""
+        with self._lock:
+            self._store(key, content)
+        self._write_disk(key, content)
+
+    def _store(self, key, content):
+        # caller holds the lock
+        if len(content) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= len(old)
+        self._entries[key] = content
+        self._size += len(content)
+        while self._size > self.max_bytes or len(self._entries) > self.max_entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+            self.evictions += 1
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key)
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._disk_path(key), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write_disk(self, key, content):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write-then-rename so concurrent workers never read a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print("⚠️ Render cache write failed:", e)
+            return
+        if self.disk_max_bytes:
+            self._maybe_prune_disk(len(content))
+
+    def _maybe_prune_disk(self, written):
+        # Scanning the directory costs a stat per entry, so it only happens when
+        # this worker's running total passes the limit or the last scan is stale.
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes += written
+            due = (
+                self._disk_bytes is None
+                or self._disk_bytes > self.disk_max_bytes
+                or time.monotonic() - self._last_disk_scan > DISK_SCAN_INTERVAL
+            )
+        if due and self._prune_lock.acquire(blocking=False):
+            try:
+                self._prune_disk()
+            finally:
+                self._prune_lock.release()
+
+    def _prune_disk(self):
+        """Drop the least recently modified disk entries once over the limit."""
+        files = []
+        total = 0
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        files.sort()
+        target = self.disk_max_bytes * DISK_PRUNE_TARGET if total > self.disk_max_bytes else total
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        with self._lock:
+            self._disk_bytes = total
+            self._last_disk_scan = time.monotonic()
+
+    def stats(self):
+        """Counters for sizing the cache; hit/miss counts are per process."""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "disk_dir": self.disk_dir,
+            }
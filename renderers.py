@@ -0,0 +1,469 @@
+import copy
+from functools import lru_cache
+from io import BytesIO
+import os
+import tempfile
+import threading
+from docx import Document
+from docx.shared import Inches
+from reportlab.lib.pagesizes import A4, LETTER, LEGAL
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+
+from assets import asset_registry
+from document_model import TableNode
+from fragment_cache import fragment_cache, fingerprint, node_weight
+from styles import registry, DocxStyles, StyleUsage
+from metrics import stage
+import table_engine
+from table_engine import MeasuredParagraph
+
+DEFAULT_MARGINS = {"top": 20, "bottom": 20, "left": 20, "right": 20}
+
+# (width, height) in inches for the DOCX section setup
+DOCX_PAGE_SIZES = {"a4": (8.27, 11.69), "letter": (8.5, 11), "legal": (8.5, 14)}
+PDF_PAGE_SIZES = {"a4": A4, "letter": LETTER, "legal": LEGAL}
+# SimpleDocTemplate's frame pads flowables by 6pt on each side
+PDF_FRAME_PADDING = 6
+
+# Streamed PDFs larger than this are spooled to disk instead of held in memory
+PDF_SPOOL_MAX_MEMORY = int(os.environ.get("PDF_SPOOL_MAX_MEMORY", 8 * 1024 * 1024))
+
+
+# Parsing the default template is most of the cost of ``Document()``; each
+# render deep-copies this already-parsed one instead. Built at import so a
+# preloading server creates it once, before forking workers.
+_PRISTINE_DOCUMENT = Document()
+_pristine_lock = threading.Lock()
+
+
+def new_document():
+    """Return a fresh, independent copy of python-docx's default document."""
+    with _pristine_lock:
+        return copy.deepcopy(_PRISTINE_DOCUMENT)
+
+
+def resolve_page_size(page_size_name):
+    """Normalise a client page size name to one of "a4", "letter" or "legal"."""
+    name = str(page_size_name or "A4").strip().lower()
+    if "letter" in name:
+        return "letter"
+    if "legal" in name:
+        return "legal"
+    return "a4"
+
+
+# ===== DOCX Helper Functions =====
+def add_docx_runs(p, runs, docx_styles):
+    """Append runs to a ``w:p`` element, pointing each at its shared character style."""
+    for run_node in runs:
+        r = p.add_r()
+        style_id = docx_styles.character_style_id(run_node.attrs)
+        if style_id is not None:
+            r.style = style_id
+        r.text = run_node.text
+
+
+def add_docx_block(doc, block, docx_styles):
+    """Append one compiled block as a DOCX paragraph."""
+    para = doc.add_paragraph()
+    para._p.style = docx_styles.paragraph_style_id(block.align, block.list_type)
+    add_docx_runs(para._p, block.runs, docx_styles)
+    return para
+
+
+def add_docx_table(doc, table_node, docx_styles):
+    """Append one compiled table to the DOCX document."""
+    return table_engine.add_docx_table(doc, table_node, docx_styles)
+
+
+def node_run_keys(node):
+    """Distinct run formats of a block or table, in first-use order."""
+    if isinstance(node, TableNode):
+        runs = (run for row in node.rows for cell in row for run in cell)
+    else:
+        runs = node.runs
+    keys = dict.fromkeys(registry.run_format(run.attrs) for run in runs)
+    keys.pop(None, None)
+    return tuple(keys)
+
+
+def add_docx_node(doc, node, docx_styles, layout):
+    """Append a block or table, copying its XML from the fragment cache when possible.
+
+    Returns True when a cached fragment was reused.
+    """
+    is_table = isinstance(node, TableNode)
+    if not fragment_cache.enabled:
+        if is_table:
+            add_docx_table(doc, node, docx_styles)
+        else:
+            add_docx_block(doc, node, docx_styles)
+        return False
+
+    # paragraphs do not depend on the page layout; table column widths do
+    key = ("docx", fingerprint(node), layout if is_table else None)
+    cached = fragment_cache.get(key)
+    if cached is not None:
+        element, run_keys = cached
+        # the copied XML points at style ids; make sure this document defines them
+        if not is_table:
+            docx_styles.paragraph_style_id(node.align, node.list_type)
+        for run_key in run_keys:
+            docx_styles.character_style_id_for_key(run_key)
+        doc.element.body.insert_element_before(copy.deepcopy(element), "w:sectPr")
+        return True
+
+    if is_table:
+        element = add_docx_table(doc, node, docx_styles)._tbl
+    else:
+        element = add_docx_block(doc, node, docx_styles)._p
+    fragment_cache.put(key, (copy.deepcopy(element), node_run_keys(node)), node_weight(node))
+    return False
+
+
+def render_docx(model, page_size_name="A4", margins=None, stats=None):
+    """Render a compiled ``DocumentModel`` to DOCX bytes.
+
+    If ``stats`` is a dict it is filled with render statistics.
+    """
+    margins = {**DEFAULT_MARGINS, **(margins or {})}
+    with stage("docx_init"):
+        doc = new_document()
+    docx_styles = DocxStyles(doc, registry)
+
+    # === PAGE SETUP ===
+    section = doc.sections[0]
+    width, height = DOCX_PAGE_SIZES[resolve_page_size(page_size_name)]
+    section.page_height = Inches(height)
+    section.page_width = Inches(width)
+
+    mm_to_inch = lambda mm: mm / 25.4
+    section.top_margin = Inches(mm_to_inch(margins["top"]))
+    section.bottom_margin = Inches(mm_to_inch(margins["bottom"]))
+    section.left_margin = Inches(mm_to_inch(margins["left"]))
+    section.right_margin = Inches(mm_to_inch(margins["right"]))
+
+    # === BODY ===
+    layout = (resolve_page_size(page_size_name), tuple(sorted(margins.items())))
+    reused = 0
+    with stage("docx_build"):
+        for node in model.nodes:
+            reused += add_docx_node(doc, node, docx_styles, layout)
+
+    output = BytesIO()
+    with stage("docx_save"):
+        doc.save(output)
+    if stats is not None:
+        stats["styles"] = docx_styles.usage.count
+        stats["fragments_reused"] = reused
+    return output.getvalue()
+
+
+# ===== PDF Helper Functions =====
+def escape_markup(text):
+    """Escape text for ReportLab paragraph markup."""
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def markup_key(attrs):
+    """The attributes that affect PDF markup, or None for plain text.
+
+    Runs with equal keys render identically and can share one span. Colors
+    are normalised to hex, so markup never carries client text; invalid ones
+    are dropped.
+    """
+    if not attrs:
+        return None
+    key = (
+        bool(attrs.get("bold")),
+        bool(attrs.get("italic")),
+        bool(attrs.get("underline")),
+        bool(attrs.get("strike")),
+        registry.pdf_color(attrs.get("color")),
+        registry.pdf_color(attrs.get("background")),
+    )
+    return key if any(key) else None
+
+
+@lru_cache(maxsize=1024)
+def markup_tags(key):
+    """Return the ``(opening, closing)`` tags for a ``markup_key``."""
+    bold, italic, underline, strike, color, background = key
+    opening = []
+    closing = []
+    font = ""
+    if color:
+        font += f' color="#{color}"'
+    if background:
+        font += f' backColor="#{background}"'
+    if font:
+        opening.append(f"<font{font}>")
+        closing.append("</font>")
+    for on, tag in ((strike, "strike"), (underline, "u"), (italic, "i"), (bold, "b")):
+        if on:
+            opening.append(f"<{tag}>")
+            closing.append(f"</{tag}>")
+    return "".join(opening), "".join(reversed(closing))
+
+
+def _append_span(parts, key, texts):
+    text = escape_markup(texts[0] if len(texts) == 1 else "".join(texts))
+    if key is None:
+        parts.append(text)
+    elif text:
+        opening, closing = markup_tags(key)
+        parts.append(f"{opening}{text}{closing}")
+
+
+def runs_markup(runs):
+    """ReportLab paragraph markup for a list of runs.
+
+    Text is escaped, neighbouring runs that render the same are merged into a
+    single span, and color and background share one ``<font>`` tag, which keeps
+    the markup ReportLab has to parse small.
+    """
+    parts = []
+    texts = []
+    current = None
+    for run in runs:
+        attrs = run.attrs
+        key = markup_key(attrs) if attrs else None
+        if key != current:
+            if texts:
+                _append_span(parts, current, texts)
+                texts = []
+            current = key
+        texts.append(run.text)
+    if texts:
+        _append_span(parts, current, texts)
+    return "".join(parts).replace("\n", "<br/>")
+
+
+def pdf_block_flowables(block, usage):
+    """Build the flowables for one compiled block; empty blocks yield nothing."""
+    html_text = runs_markup(block.runs).strip()
+    if not html_text:
+        return []
+
+    paragraph_style = registry.pdf_paragraph_style(block.align, block.list_type, usage)
+    for run in block.runs:
+        run_key = registry.run_format(run.attrs)
+        if run_key is not None:
+            usage.run.add(run_key)
+
+    if block.list_type == "bullet":
+        para = MeasuredParagraph(html_text, paragraph_style, bulletText="•")
+    elif block.list_type == "ordered":
+        para = MeasuredParagraph(f"{block.ordinal}. {html_text}", paragraph_style)
+    else:
+        para = MeasuredParagraph(html_text, paragraph_style)
+    return [para, Spacer(1, 4)]
+
+
+def pdf_table_flowables(table_node, frame_width):
+    """Build the flowables for one compiled table."""
+    return table_engine.pdf_table_flowables(table_node, frame_width, runs_markup)
+
+
+def pdf_frame_width(page_size_name, margins):
+    """Width between the side margins of a page, which flowables are laid out in."""
+    margins = {**DEFAULT_MARGINS, **(margins or {})}
+    return PDF_PAGE_SIZES[resolve_page_size(page_size_name)][0] - margins["left"] - margins["right"]
+
+
+def prewrap_pdf_flowables(flowables, frame_width):
+    """Break the lines of ``flowables`` at the frame's width so later layouts reuse them."""
+    avail_width = frame_width - 2 * PDF_FRAME_PADDING
+    for flowable in flowables:
+        if isinstance(flowable, Paragraph):
+            flowable.wrap(avail_width, 0x7FFFFFFF)
+    return flowables
+
+
+def pdf_doc_template(target, page_size_name, margins):
+    """Create the ReportLab document template; returns ``(doc, frame_width)``."""
+    margins = {**DEFAULT_MARGINS, **(margins or {})}
+    page_size = PDF_PAGE_SIZES[resolve_page_size(page_size_name)]
+    doc = SimpleDocTemplate(
+        target,
+        pagesize=page_size,
+        topMargin=margins["top"],
+        bottomMargin=margins["bottom"],
+        leftMargin=margins["left"],
+        rightMargin=margins["right"],
+        pageCompression=int(asset_registry.page_compression),
+    )
+    return doc, pdf_frame_width(page_size_name, margins)
+
+
+def cached_pdf_block_flowables(block, frame_width, usage):
+    """Like ``pdf_block_flowables`` but reusing measured flowables from the fragment cache.
+
+    Returns ``(flowables, reused)``.
+    """
+    key = ("pdf", fingerprint(block), block.ordinal, frame_width)
+    cached = fragment_cache.get(key)
+    if cached is None:
+        # measure once at the frame's width so every reuse skips the line breaking
+        flowables = prewrap_pdf_flowables(pdf_block_flowables(block, usage), frame_width)
+        fragment_cache.put(key, (flowables, node_run_keys(block)), node_weight(block))
+        reused = False
+    else:
+        flowables, run_keys = cached
+        if flowables:
+            registry.pdf_paragraph_style(block.align, block.list_type, usage)
+            usage.run.update(run_keys)
+        reused = True
+    return [table_engine.copy_flowable(f) for f in flowables], reused
+
+
+def cached_pdf_table_flowables(table_node, frame_width):
+    """Like ``pdf_table_flowables`` but reusing a measured table from the fragment cache.
+
+    Returns ``(flowables, reused)``.
+    """
+    key = ("pdf", fingerprint(table_node), frame_width)
+    measured = fragment_cache.get(key)
+    reused = measured is not None
+    if not reused:
+        measured = table_engine.measure_pdf_table(table_node, frame_width, runs_markup)
+        fragment_cache.put(key, measured, node_weight(table_node))
+    return measured.flowables(copy_cells=True), reused
+
+
+def iter_pdf_flowables(nodes, frame_width, usage, stats=None):
+    """Yield the flowables for a sequence of compiled nodes.
+
+    If ``stats`` is a dict, ``fragments_reused`` counts nodes served from the
+    fragment cache.
+    """
+    if not fragment_cache.enabled:
+        for node in nodes:
+            if isinstance(node, TableNode):
+                yield from pdf_table_flowables(node, frame_width)
+            else:
+                yield from pdf_block_flowables(node, usage)
+        return
+
+    if stats is None:
+        stats = {}
+    stats["fragments_reused"] = 0
+    for node in nodes:
+        if isinstance(node, TableNode):
+            flowables, reused = cached_pdf_table_flowables(node, frame_width)
+        else:
+            flowables, reused = cached_pdf_block_flowables(node, frame_width, usage)
+        stats["fragments_reused"] += reused
+        yield from flowables
+
+
+def page_callback(stats):
+    """Page callback that draws the letterhead and keeps ``stats["pages"]`` current."""
+    letterhead = asset_registry.letterhead
+
+    def on_page(canvas, doc):
+        if letterhead is not None:
+            # fills the top margin, less a little air below the page edge and above the frame
+            letterhead.draw(canvas, doc.leftMargin, doc.pagesize[1] - doc.topMargin + 2,
+                            doc.width, doc.topMargin - 6)
+        if stats is not None:
+            stats["pages"] = doc.page
+    return on_page
+
+
+def embedded_fonts(doc):
+    """Number of fonts a built document references."""
+    return len(doc.canv._doc.fontMapping)
+
+
+def render_pdf(model, page_size_name="A4", margins=None, stats=None):
+    """Render a compiled ``DocumentModel`` to PDF bytes.
+
+    If ``stats`` is a dict it is filled with render statistics; ``pages`` is
+    updated as each page is started so it can be polled during layout.
+    """
+    buffer = BytesIO()
+    doc, frame_width = pdf_doc_template(buffer, page_size_name, margins)
+    usage = StyleUsage()
+    on_page = page_callback(stats)
+    # flowables are created lazily, so this covers markup, layout and writing
+    with stage("pdf_build"):
+        doc.build(
+            LazyStory(iter_pdf_flowables(model.nodes, frame_width, usage, stats)),
+            onFirstPage=on_page,
+            onLaterPages=on_page
+        )
+    if stats is not None:
+        stats["styles"] = usage.count
+        stats["fonts"] = embedded_fonts(doc)
+    return buffer.getvalue()
+
+
+class LazyStory(list):
+    """A story list that pulls flowables from an iterator as layout consumes them.
+
+    ``BaseDocTemplate.build`` only ever looks at the head of the story and
+    deletes flowables once they are placed, so topping the list up on demand
+    keeps just the current flowable (plus any split remainders) alive instead
+    of the whole document.
+    """
+
+    def __init__(self, flowables):
+        super().__init__()
+        self._source = iter(flowables)
+
+    def _fill(self, count):
+        while super().__len__() < count:
+            try:
+                self.append(next(self._source))
+            except StopIteration:
+                return
+
+    def __len__(self):
+        self._fill(1)
+        return super().__len__()
+
+    def __getitem__(self, index):
+        if isinstance(index, int) and index >= 0:
+            self._fill(index + 1)
+        return super().__getitem__(index)
+
+
+def render_pdf_stream(nodes, page_size_name="A4", margins=None, chunk_size=64 * 1024, stats=None):
+    """Lay out a lazily produced node sequence and yield the PDF in chunks.
+
+    Nodes and flowables are created only as layout reaches them, so the delta
+    and the story are never held whole, and the output is spooled to a
+    temporary file once it outgrows ``PDF_SPOOL_MAX_MEMORY``. This is not
+    incremental output: ReportLab keeps every finished page object until
+    ``save``, so memory still grows with page count, and nothing can be
+    yielded before layout of the whole document has finished.
+    """
+    with tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_MAX_MEMORY) as spool:
+        doc, frame_width = pdf_doc_template(spool, page_size_name, margins)
+        usage = StyleUsage()
+        on_page = page_callback(stats)
+        with stage("pdf_build"):
+            doc.build(
+                LazyStory(iter_pdf_flowables(nodes, frame_width, usage, stats)),
+                onFirstPage=on_page,
+                onLaterPages=on_page
+            )
+        if stats is not None:
+            stats["styles"] = usage.count
+            stats["fonts"] = embedded_fonts(doc)
+        spool.seek(0)
+        while True:
+            chunk = spool.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+RENDERERS = {
+    "docx": (
+        render_docx,
+        "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    ),
+    "pdf": (render_pdf, "application/pdf"),
+}
@@ -0,0 +1,84 @@
+"""Warm-up and readiness for production serving.
+
+``warm_up`` renders a small document through both back ends so that lazily
+loaded pieces (metrics for every variant of the body font, the shared stylesheet
+and style registry, python-docx's XML classes, the table engine) are in place
+before the first real request. ``wsgi.py`` calls it in the gunicorn master so
+forked workers inherit the warmed state copy-on-write; ``readiness`` backs the
+``/ready`` endpoint.
+"""
+import json
+import os
+import threading
+import time
+
+PROCESS_STARTED = time.time()
+
+_state = {
+    "status": "cold",
+    "warmup_seconds": None,
+    "ready_at": None,
+    "error": None,
+}
+_lock = threading.Lock()
+
+WARMUP_TABLE = {
+    "columns": ["item", "amount"],
+    "rows": [
+        {"item": [{"insert": "Item"}], "amount": [{"insert": "Amount", "attributes": {"bold": True}}]},
+        {"item": [{"insert": "Filing fee"}], "amount": [{"insert": "$100", "attributes": {"italic": True}}]},
+    ],
+}
+WARMUP_DELTA = [
+    {"insert": "Warm-up", "attributes": {"bold": True, "italic": True, "color": "#1E88E5"}},
+    {"insert": "\n", "attributes": {"align": "center"}},
+    {"insert": "Plain, "},
+    {"insert": "bold", "attributes": {"bold": True}},
+    {"insert": ", "},
+    {"insert": "italic", "attributes": {"italic": True, "underline": True, "strike": True}},
+    {"insert": " and highlighted", "attributes": {"background": "#FFF59D"}},
+    {"insert": "\n"},
+    {"insert": "First"},
+    {"insert": "\n", "attributes": {"list": "ordered"}},
+    {"insert": "Second"},
+    {"insert": "\n", "attributes": {"list": "bullet"}},
+    {"insert": {"custom": json.dumps({"table": json.dumps(WARMUP_TABLE)})}},
+    {"insert": "\n"},
+]
+
+
+def warm_up():
+    """Render the warm-up document with every renderer; safe to call repeatedly."""
+    with _lock:
+        if _state["status"] == "ready":
+            return dict(_state)
+        _state["status"] = "warming"
+        start = time.perf_counter()
+        try:
+            from document_model import compile_delta
+            from renderers import RENDERERS
+
+            model = compile_delta(WARMUP_DELTA)
+            for render, _ in RENDERERS.values():
+                for page_size_name in ("a4", "letter", "legal"):
+                    render(model, page_size_name)
+        except Exception as e:
+            print("⚠️ Warm-up failed:", e)
+            _state.update(status="failed", error=str(e))
+        else:
+            _state.update(status="ready", error=None, ready_at=time.time())
+        _state["warmup_seconds"] = round(time.perf_counter() - start, 4)
+        return dict(_state)
+
+
+def readiness():
+    """Startup time and warm-up status for this process."""
+    with _lock:
+        state = dict(_state)
+    state.update(
+        pid=os.getpid(),
+        started_at=PROCESS_STARTED,
+        startup_seconds=round(state["ready_at"] - PROCESS_STARTED, 4) if state["ready_at"] else None,
+        uptime_seconds=round(time.time() - PROCESS_STARTED, 4),
+    )
+    return state
@@ -0,0 +1,217 @@
+"""Process-wide style registry for both renderers.
+
+Thousands of runs in a contract share a handful of attribute combinations:
+ReportLab ``ParagraphStyle`` objects are built once per process for the few
+alignment/list combinations and reused across requests, and DOCX
+output gets one named paragraph/character style per combination that runs and
+paragraphs point to instead of repeating direct formatting.
+"""
+import re
+import threading
+from functools import lru_cache
+
+from docx.enum.style import WD_STYLE_TYPE
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.shared import RGBColor, Pt, Inches
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_LEFT, TA_CENTER, TA_RIGHT, TA_JUSTIFY
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+
+from assets import asset_registry
+
+DOCX_ALIGNMENTS = {
+    "center": WD_ALIGN_PARAGRAPH.CENTER,
+    "right": WD_ALIGN_PARAGRAPH.RIGHT,
+    "justify": WD_ALIGN_PARAGRAPH.JUSTIFY,
+}
+PDF_ALIGNMENTS = {"center": TA_CENTER, "right": TA_RIGHT, "justify": TA_JUSTIFY}
+DOCX_LIST_STYLES = {"bullet": "List Bullet", "ordered": "List Number"}
+# distinct color strings whose parse is remembered; clients choose them, so bounded
+COLOR_CACHE_SIZE = 4096
+HEX_COLOR_RE = re.compile(r"#?(?:[0-9A-Fa-f]{2})?[0-9A-Fa-f]{6}")
+
+
+def parse_hex_color(color):
+    """Parse #RRGGBB or #AARRGGBB into an "RRGGBB" string, or None if invalid."""
+    hex_color = str(color).lstrip("#")
+    # If alpha channel is present (e.g., #FFE53935), strip it
+    if len(hex_color) == 8:
+        hex_color = hex_color[2:]
+    if len(hex_color) != 6:
+        print(f"⚠️ Unexpected color format: {color}")
+        return None
+    try:
+        int(hex_color, 16)
+    except ValueError:
+        print(f"⚠️ Invalid color: {color}")
+        return None
+    return hex_color.upper()
+
+
+def parse_pdf_color(color):
+    """Parse a color for PDF markup into an "RRGGBB" string, or None if invalid.
+
+    Hex values are read as for DOCX; anything else is left to ReportLab, which
+    also knows CSS color names and ``rgb()``. Fully transparent colors are None.
+    """
+    if HEX_COLOR_RE.fullmatch(color):
+        return parse_hex_color(color)
+    try:
+        parsed = colors.toColor(color)
+        if getattr(parsed, "alpha", 1) == 0:
+            return None
+        return parsed.hexval()[2:].upper()
+    except Exception:
+        print(f"⚠️ Invalid color: {color}")
+        return None
+
+
+_parse_color_cached = lru_cache(maxsize=COLOR_CACHE_SIZE)(parse_hex_color)
+_parse_pdf_color_cached = lru_cache(maxsize=COLOR_CACHE_SIZE)(parse_pdf_color)
+
+
+class StyleUsage:
+    """Distinct styles referenced while rendering one document."""
+    __slots__ = ("paragraph", "run")
+
+    def __init__(self):
+        self.paragraph = set()
+        self.run = set()
+
+    @property
+    def count(self):
+        return len(self.paragraph) + len(self.run)
+
+
+class StyleRegistry:
+    """Shared paragraph styles and run format keys derived from attribute sets."""
+
+    def __init__(self):
+        self.stylesheet = getSampleStyleSheet()
+        # body paragraphs and table cells all derive from Normal
+        self.stylesheet["Normal"].fontName = asset_registry.body_font
+        self.stylesheet["Normal"].bulletFontName = asset_registry.body_font
+        self._pdf_paragraph = {}
+        self._lock = threading.Lock()
+
+    # ---- shared keys ----
+    def color(self, color):
+        """Return the normalised hex for ``color``, or None if it is not a valid color.
+
+        Recent values are remembered in a bounded cache, so they are parsed once.
+        """
+        if not isinstance(color, str):
+            return None
+        return _parse_color_cached(color)
+
+    def pdf_color(self, color):
+        """Like ``color`` but also accepting the color names ReportLab knows."""
+        if not isinstance(color, str):
+            return None
+        return _parse_pdf_color_cached(color)
+
+    def run_format(self, attrs):
+        """Return the ``(bold, italic, underline, strike, color)`` key for a run."""
+        if not attrs:
+            return None
+        color = attrs.get("color")
+        key = (
+            bool(attrs.get("bold")),
+            bool(attrs.get("italic")),
+            bool(attrs.get("underline")),
+            bool(attrs.get("strike")),
+            self.color(color) if color else None,
+        )
+        if key == (False, False, False, False, None):
+            return None
+        return key
+
+    # ---- PDF ----
+    def pdf_paragraph_style(self, align, list_type=None, usage=None):
+        """Return the shared ``ParagraphStyle`` for a block's alignment and list type."""
+        # unknown values render as the defaults, so they must not mint styles of their own
+        key = (align if align in PDF_ALIGNMENTS else None, list_type if list_type in DOCX_LIST_STYLES else None)
+        style = self._pdf_paragraph.get(key)
+        if style is None:
+            with self._lock:
+                style = self._pdf_paragraph.get(key)
+                if style is None:
+                    style = ParagraphStyle(
+                        name=f"Quill-{key[0] or 'left'}-{key[1] or 'body'}",
+                        parent=self.stylesheet["Normal"],
+                        alignment=PDF_ALIGNMENTS.get(align, TA_LEFT),
+                        leading=14,
+                        spaceAfter=6,
+                    )
+                    self._pdf_paragraph[key] = style
+        if usage is not None:
+            usage.paragraph.add(key)
+        return style
+
+
+class DocxStyles:
+    """Named DOCX styles created on demand inside one ``Document``.
+
+    Lookups return style ids to set directly on ``w:pPr``/``w:rPr``; going
+    through python-docx's ``run.style = ...`` rescans every style in the
+    document on each assignment.
+    """
+
+    def __init__(self, doc, registry, usage=None):
+        self.doc = doc
+        self.registry = registry
+        self.usage = usage if usage is not None else StyleUsage()
+        self._paragraph = {}
+        self._character = {}
+
+    def paragraph_style_id(self, align, list_type=None):
+        """Return the paragraph style id for a block, creating the style on first use."""
+        # unknown values render as the defaults, as in ``pdf_paragraph_style``
+        key = (align if align in DOCX_ALIGNMENTS else None, list_type if list_type in DOCX_LIST_STYLES else None)
+        style_id = self._paragraph.get(key)
+        if style_id is None:
+            name = f"Quill {key[0] or 'left'} {key[1] or 'body'}"
+            style = self.doc.styles.add_style(name, WD_STYLE_TYPE.PARAGRAPH)
+            style.base_style = self.doc.styles[DOCX_LIST_STYLES.get(key[1], "Normal")]
+            style.hidden = True
+            pf = style.paragraph_format
+            pf.left_indent = Inches(0.25 if key[1] else 0)
+            pf.space_after = Pt(0)
+            pf.line_spacing = Pt(12)
+            pf.alignment = DOCX_ALIGNMENTS.get(align, WD_ALIGN_PARAGRAPH.LEFT)
+            style_id = self._paragraph[key] = style.style_id
+        self.usage.paragraph.add(key)
+        return style_id
+
+    def character_style_id(self, attrs):
+        """Return the character style id for a run's attributes, or None for plain text."""
+        return self.character_style_id_for_key(self.registry.run_format(attrs))
+
+    def character_style_id_for_key(self, key):
+        """Like ``character_style_id`` but for a key from ``StyleRegistry.run_format``."""
+        if key is None:
+            return None
+        style_id = self._character.get(key)
+        if style_id is None:
+            bold, italic, underline, strike, color = key
+            flags = "".join(f for f, on in zip("BIUS", key[:4]) if on)
+            name = f"Quill Run {flags}{' ' + color if color else ''}".rstrip()
+            style = self.doc.styles.add_style(name, WD_STYLE_TYPE.CHARACTER)
+            style.hidden = True
+            font = style.font
+            if bold:
+                font.bold = True
+            if italic:
+                font.italic = True
+            if underline:
+                font.underline = True
+            if strike:
+                font.strike = True
+            if color:
+                font.color.rgb = RGBColor.from_string(color)
+            style_id = self._character[key] = style.style_id
+        self.usage.run.add(key)
+        return style_id
+
+
+registry = StyleRegistry()
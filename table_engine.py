@@ -0,0 +1,193 @@
+"""Table rendering for large ``custom`` tables.
+
+Both back ends used to treat a table as a grid of independent cells, which is
+quadratic in python-docx (``table.cell(r, c)`` rebuilds the cell list on every
+call) and makes ReportLab measure a ``Paragraph`` per cell. This engine instead:
+
+* appends DOCX rows, cells and runs straight onto the table XML in one pass,
+  without python-docx proxy objects;
+* hands ReportLab a ``LongTable`` with precomputed column widths, row heights
+  and repeated header rows. Each cell is measured exactly once here; without
+  the heights ReportLab re-wraps every remaining cell each time the table is
+  split across a page;
+* uses plain strings instead of ``Paragraph`` for PDF cells without inline
+  formatting that fit on one line.
+
+The PDF side is split into ``measure_pdf_table`` and ``MeasuredTable.flowables``
+so a measured table can be kept in the fragment cache and rebuilt cheaply.
+"""
+import copy
+
+from docx.oxml import OxmlElement
+from reportlab.lib import colors
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.platypus import LongTable, Paragraph, Spacer, TableStyle
+
+from assets import asset_registry
+from styles import registry
+
+# ReportLab table defaults: 6pt horizontal and 3pt vertical padding, 10/12 type in the body font
+CELL_PADDING = 12
+CELL_VERTICAL_PADDING = 6
+CELL_FONT = asset_registry.body_font
+CELL_FONT_SIZE = 10
+CELL_LEADING = 12
+
+PDF_TABLE_STYLE = TableStyle([
+    ("GRID", (0, 0), (-1, -1), 0.5, colors.black),
+    ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+    ("FONTNAME", (0, 0), (-1, -1), CELL_FONT),
+    ("FONTSIZE", (0, 0), (-1, -1), CELL_FONT_SIZE),
+])
+
+
+def header_rows(table_node):
+    """Rows to repeat on each page; never the whole table."""
+    return max(0, min(table_node.header_rows, len(table_node.rows) - 1))
+
+
+def plain_cell_text(cell_runs):
+    """Return the cell text if no run carries attributes, else None."""
+    if any(run.attrs for run in cell_runs):
+        return None
+    return "".join(run.text for run in cell_runs)
+
+
+# ===== DOCX =====
+def add_docx_table(doc, table_node, docx_styles):
+    """Append one compiled table to the DOCX document in a single pass."""
+    table = doc.add_table(rows=0, cols=len(table_node.columns))
+    tbl = table._tbl
+    widths = [grid_col.w for grid_col in tbl.tblGrid.gridCol_lst]
+    repeat = header_rows(table_node)
+
+    for r_idx, row in enumerate(table_node.rows):
+        tr = tbl.add_tr()
+        if r_idx < repeat:
+            tr.get_or_add_trPr().append(OxmlElement("w:tblHeader"))
+        for width, cell_runs in zip(widths, row):
+            tc = tr.add_tc()
+            tc.width = width
+            if not cell_runs:
+                continue
+            p = tc.p_lst[0]
+            text = plain_cell_text(cell_runs)
+            if text is not None:
+                p.add_r().text = text
+                continue
+            for run_node in cell_runs:
+                r = p.add_r()
+                style_id = docx_styles.character_style_id(run_node.attrs)
+                if style_id is not None:
+                    r.style = style_id
+                r.text = run_node.text
+    return table
+
+
+# ===== PDF =====
+class MeasuredParagraph(Paragraph):
+    """A Paragraph that remembers its last wrap.
+
+    Paragraphs are measured ahead of layout (table cells for row heights,
+    cached fragments once when they are built) and ReportLab wraps them again
+    before drawing, at the same width; the second wrap reuses the line breaks
+    from the first instead of redoing them.
+    """
+
+    _wrapped_for = None
+    # set on copies whose line breaks belong to a shared prototype
+    _shared_lines = False
+
+    def wrap(self, availWidth, availHeight):
+        if (self._wrapped_for is not None and abs(self._wrapped_for - availWidth) < 1e-6
+                and "blPara" in self.__dict__):
+            return self.width, self.height
+        size = super().wrap(availWidth, availHeight)
+        self._wrapped_for = availWidth
+        return size
+
+    def split(self, availWidth, availHeight):
+        if self._shared_lines:
+            # splitting rewrites the words of rich-text lines in place, so
+            # break the lines again for this copy alone
+            self._shared_lines = False
+            self.__dict__.pop("blPara", None)
+        return super().split(availWidth, availHeight)
+
+
+def copy_flowable(flowable):
+    """Per-render copy of a shared flowable.
+
+    Layout leaves state on flowables (``_postponed``, the canvas, a Paragraph's
+    line breaks), so shared prototypes must never be laid out directly.
+    """
+    if isinstance(flowable, str):
+        return flowable
+    clone = copy.copy(flowable)
+    if "blPara" in clone.__dict__:
+        clone._shared_lines = True
+    return clone
+
+
+def pdf_cell(cell_runs, col_width, markup):
+    """A plain string when the cell needs no markup or wrapping, else a Paragraph."""
+    text = plain_cell_text(cell_runs)
+    if text is not None and "\n" not in text and (
+        not text or stringWidth(text, CELL_FONT, CELL_FONT_SIZE) <= col_width - CELL_PADDING
+    ):
+        return text
+    return MeasuredParagraph(markup(cell_runs) or "&nbsp;", registry.stylesheet["Normal"])
+
+
+def cell_height(cell, inner_width):
+    """Height of a cell value including padding, as ReportLab would compute it."""
+    if isinstance(cell, str):
+        return CELL_LEADING * (cell.count("\n") + 1) + CELL_VERTICAL_PADDING
+    return cell.wrap(inner_width, 0x7FFFFFFF)[1] + CELL_VERTICAL_PADDING
+
+
+class MeasuredTable:
+    """The cells and row heights of one table, ready to become a ``LongTable``."""
+    __slots__ = ("rows", "col_widths", "row_heights", "repeat_rows")
+
+    def __init__(self, rows, col_widths, row_heights, repeat_rows):
+        self.rows = rows
+        self.col_widths = col_widths
+        self.row_heights = row_heights
+        self.repeat_rows = repeat_rows
+
+    def flowables(self, copy_cells=False):
+        """Build the table flowables; ``copy_cells`` when the cells are shared between renders."""
+        rows = self.rows
+        if copy_cells:
+            rows = [[copy_flowable(cell) for cell in row] for row in rows]
+        table = LongTable(
+            rows,
+            colWidths=list(self.col_widths),
+            rowHeights=list(self.row_heights),
+            repeatRows=self.repeat_rows,
+            style=PDF_TABLE_STYLE,
+        )
+        return [table, Spacer(1, 12)]
+
+
+def measure_pdf_table(table_node, frame_width, markup):
+    """Build and measure the cells of one compiled table.
+
+    ``markup`` turns a list of runs into ReportLab paragraph markup.
+    """
+    col_count = len(table_node.columns)
+    col_width = frame_width / col_count
+    inner_width = col_width - CELL_PADDING
+    data_rows = []
+    row_heights = []
+    for row in table_node.rows:
+        cells = [pdf_cell(cell_runs, col_width, markup) for cell_runs in row]
+        data_rows.append(cells)
+        row_heights.append(max(cell_height(cell, inner_width) for cell in cells))
+    return MeasuredTable(data_rows, [col_width] * col_count, row_heights, header_rows(table_node))
+
+
+def pdf_table_flowables(table_node, frame_width, markup):
+    """Build the flowables for one compiled table."""
+    return measure_pdf_table(table_node, frame_width, markup).flowables()
@@ -0,0 +1,216 @@
+"""Registered templates: compile a delta once, then fill placeholders per render.
+
+A template is a delta whose text contains ``{{name}}`` placeholders. On
+registration it is compiled to the document model, rendered once to a DOCX
+prototype, and its placeholder-free blocks and tables are turned into measured
+ReportLab flowables up front. A render then only substitutes the variables:
+the DOCX path patches the recorded text nodes of the prototype, and the PDF
+path rebuilds just the blocks and tables that contain placeholders.
+
+Templates are content-addressed and their source is written to ``TEMPLATE_DIR``,
+so any worker can compile a template registered by another one.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from docx import Document
+from docx.oxml.ns import qn
+
+from document_model import Block, Run, TableNode, compile_delta
+from renderers import (
+    DEFAULT_MARGINS, render_docx, pdf_doc_template, pdf_block_flowables, pdf_table_flowables, page_callback,
+    pdf_frame_width, prewrap_pdf_flowables, runs_markup,
+)
+from styles import StyleUsage
+from table_engine import MeasuredTable, copy_flowable, measure_pdf_table
+
+PLACEHOLDER_RE = re.compile(r"\{\{\s*([A-Za-z0-9_.\-]+)\s*\}\}")
+XML_SPACE = "{http://www.w3.org/XML/1998/namespace}space"
+
+TEMPLATE_DIR = os.environ.get("TEMPLATE_DIR") or os.path.join(tempfile.gettempdir(), "legallyai-templates")
+TEMPLATE_CACHE_SIZE = int(os.environ.get("TEMPLATE_CACHE_SIZE", 64))
+
+
+def fill_placeholders(text, variables):
+    """Replace ``{{name}}`` with ``variables[name]``; unknown names are left as-is."""
+    def replace(match):
+        name = match.group(1)
+        return str(variables[name]) if name in variables else match.group(0)
+    return PLACEHOLDER_RE.sub(replace, text)
+
+
+def _runs_have_placeholders(runs):
+    return any(PLACEHOLDER_RE.search(run.text) for run in runs)
+
+
+def _node_has_placeholders(node):
+    if isinstance(node, TableNode):
+        return any(_runs_have_placeholders(cell) for row in node.rows for cell in row)
+    return _runs_have_placeholders(node.runs)
+
+
+def _fill_runs(runs, variables):
+    return [Run(fill_placeholders(run.text, variables), run.attrs) for run in runs]
+
+
+def _fill_node(node, variables):
+    if isinstance(node, TableNode):
+        rows = [[_fill_runs(cell, variables) for cell in row] for row in node.rows]
+        return TableNode(node.columns, rows, node.header_rows)
+    return Block(_fill_runs(node.runs, variables), node.align, node.list_type, node.ordinal)
+
+
+class CompiledTemplate:
+    """The precompiled form of one registered template."""
+    __slots__ = ("template_id", "page_size_name", "margins", "model", "placeholders",
+                 "docx_proto", "docx_slots", "pdf_parts")
+
+    def __init__(self, template_id, delta, page_size_name, margins):
+        self.template_id = template_id
+        self.page_size_name = page_size_name
+        self.margins = {**DEFAULT_MARGINS, **(margins or {})}
+        self.model = compile_delta(delta)
+
+        names = set()
+        for node in self.model.nodes:
+            runs = [run for row in node.rows for cell in row for run in cell] \
+                if isinstance(node, TableNode) else node.runs
+            for run in runs:
+                names.update(PLACEHOLDER_RE.findall(run.text))
+        self.placeholders = sorted(names)
+
+        self._compile_docx()
+        self._compile_pdf()
+
+    def _compile_docx(self):
+        # Render once with the placeholders in place and remember which text
+        # nodes need patching; everything else is reused verbatim.
+        self.docx_proto = render_docx(self.model, self.page_size_name, self.margins)
+        body = Document(BytesIO(self.docx_proto)).element.body
+        self.docx_slots = [
+            (index, t.text)
+            for index, t in enumerate(body.iter(qn("w:t")))
+            if t.text and PLACEHOLDER_RE.search(t.text)
+        ]
+
+    def _compile_pdf(self):
+        # Static blocks become flowables with their lines already broken and
+        # static tables are measured, both at the template's frame width;
+        # only nodes with placeholders are kept and built per render.
+        frame_width = pdf_frame_width(self.page_size_name, self.margins)
+        usage = StyleUsage()
+        parts = []
+        for node in self.model.nodes:
+            if _node_has_placeholders(node):
+                parts.append(node)
+            elif isinstance(node, TableNode):
+                parts.append(measure_pdf_table(node, frame_width, runs_markup))
+            else:
+                parts.append(prewrap_pdf_flowables(pdf_block_flowables(node, usage), frame_width))
+        self.pdf_parts = parts
+
+    def render_docx(self, variables):
+        doc = Document(BytesIO(self.docx_proto))
+        if self.docx_slots:
+            texts = list(doc.element.body.iter(qn("w:t")))
+            for index, template_text in self.docx_slots:
+                t = texts[index]
+                t.text = fill_placeholders(template_text, variables)
+                if t.text != t.text.strip():
+                    t.set(XML_SPACE, "preserve")
+        output = BytesIO()
+        doc.save(output)
+        return output.getvalue()
+
+    def render_pdf(self, variables):
+        buffer = BytesIO()
+        doc, frame_width = pdf_doc_template(buffer, self.page_size_name, self.margins)
+        usage = StyleUsage()
+        story = []
+        for part in self.pdf_parts:
+            if isinstance(part, list):
+                # layout mutates flowables, so each render lays out its own copy
+                story.extend(copy_flowable(f) for f in part)
+            elif isinstance(part, MeasuredTable):
+                story.extend(part.flowables(copy_cells=True))
+            elif isinstance(part, TableNode):
+                story.extend(pdf_table_flowables(_fill_node(part, variables), frame_width))
+            else:
+                story.extend(pdf_block_flowables(_fill_node(part, variables), usage))
+        on_page = page_callback(None)
+        doc.build(story, onFirstPage=on_page, onLaterPages=on_page)
+        return buffer.getvalue()
+
+    def render(self, fmt, variables):
+        if fmt == "docx":
+            return self.render_docx(variables)
+        return self.render_pdf(variables)
+
+
+def template_id_for(delta, page_size_name, margins):
+    """Content-address a template so every worker derives the same id."""
+    canonical = json.dumps(
+        {"delta": delta, "page_size": page_size_name, "margins": margins},
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+
+
+class TemplateStore:
+    """Template sources on disk plus a bounded per-process cache of compiled forms."""
+
+    def __init__(self, directory=TEMPLATE_DIR, max_compiled=TEMPLATE_CACHE_SIZE):
+        self.directory = directory
+        self.max_compiled = max_compiled
+        self._compiled = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, template_id):
+        return os.path.join(self.directory, f"{template_id}.json")
+
+    def register(self, delta, page_size_name="a4", margins=None):
+        """Store and compile a template; returns the ``CompiledTemplate``."""
+        margins = {**DEFAULT_MARGINS, **(margins or {})}
+        template_id = template_id_for(delta, page_size_name, margins)
+        compiled = CompiledTemplate(template_id, delta, page_size_name, margins)
+
+        source = {"delta": delta, "page_size": page_size_name, "margins": margins}
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(source, f)
+        os.replace(tmp_path, self._path(template_id))
+
+        self._remember(compiled)
+        return compiled
+
+    def get(self, template_id):
+        """Return the compiled template, compiling from disk on a miss; None if unknown."""
+        if not re.fullmatch(r"[0-9a-f]{32}", template_id):
+            return None
+        with self._lock:
+            compiled = self._compiled.get(template_id)
+            if compiled is not None:
+                self._compiled.move_to_end(template_id)
+                return compiled
+        try:
+            with open(self._path(template_id), encoding="utf-8") as f:
+                source = json.load(f)
+        except OSError:
+            return None
+        compiled = CompiledTemplate(template_id, source["delta"], source["page_size"], source["margins"])
+        self._remember(compiled)
+        return compiled
+
+    def _remember(self, compiled):
+        with self._lock:
+            self._compiled[compiled.template_id] = compiled
+            self._compiled.move_to_end(compiled.template_id)
+            while len(self._compiled) > self.max_compiled:
+                self._compiled.popitem(last=False)
@@ -0,0 +1,18 @@
+"""WSGI entry point for production serving: ``gunicorn -c gunicorn.conf.py wsgi:app``.
+
+With ``preload_app`` gunicorn imports this module once in the master process:
+ReportLab, python-docx and lxml are loaded, the pristine default ``Document``
+is parsed and the warm-up render runs before any worker is forked, so every
+worker starts warm and shares those pages copy-on-write.
+"""
+import gc
+
+import serving
+from app import app
+
+serving.warm_up()
+# Keep the preloaded objects out of future collections so the cyclic GC does
+# not touch (and thereby un-share) their pages in each worker.
+gc.freeze()
+
+__all__ = ["app"]